@@ -112,6 +112,35 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 AUTH_USER_MODEL = 'core.User'
 
 
+# Database routing
+# Aliases listed in DATABASE_REPLICAS (and defined in DATABASES) receive read-only queries.
+# Tickets are sharded by contest across TICKET_SHARDS: {database alias: cache alias for its
+# reservations}, see core/sharding.py. Leave it empty to keep every ticket on the primary.
+DATABASE_ROUTERS = ['core.routers.ShardRouter', 'core.routers.ReplicaRouter']
+DATABASE_REPLICAS = []
+TICKET_SHARDS = {}
+# The database (alias) holding the default cache's table. Set it to an alias of the primary with a
+# connection pool of its own to keep cache traffic from competing with the ORM, see core/db/pool.py.
+CACHE_DATABASE = 'default'
+
+
 # Local settings
 HOURS_THRESHOLD = 2  # we'll stop selling tickets HOURS_THRESHOLD hours before a contest
 RESERVATION_THRESHOLD = 60*5  # The time (in seconds) we'll hold a ticket reserved
+REPLICA_STICKINESS = 30  # Time (in seconds) a user's reads stay on the primary after a purchase
+
+# Outbox consumers: {name: {'BACKEND': sink class, 'OPTIONS': kwargs}}, see core/outbox.py
+# Once a deployment has one, add 'worker: cd api && python manage.py relay_outbox' to the Procfile.
+OUTBOX_SINKS = {}
+OUTBOX_GAP_TIMEOUT = 600  # Time (in seconds) a skipped event id is looked for before giving up
+
+# Webhook deadline, see core/deadline.py. Dialogflow waits ~5 seconds for an answer.
+WEBHOOK_DEADLINE = 4  # Time (in seconds) a webhook turn may take
+WEBHOOK_DEADLINE_RESERVE = 0.5  # Time (in seconds) kept to answer. No calls are made within it.
+WEBHOOK_MAX_RESUMES = 2  # Times a turn that ran out of time is resumed before giving up
+FAULT_INJECTION = {}  # Latency (in seconds) added to 'db', 'cache' or 'payment' calls. Tests only.
+
+# Direct Twilio channel, see core/views/twilio
+CONVERSATION_TIMEOUT = 60*30  # Time (in seconds) a user's place in the purchase flow is remembered
+TWILIO_VALIDATE_SIGNATURE = True  # Reject requests not signed by Twilio
+TWILIO_AUTH_TOKEN = os.environ.get('TWILIO_AUTH_TOKEN', '')
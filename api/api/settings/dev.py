@@ -1,5 +1,6 @@
 """ Development settings """
 
+import json
 import os
 
 from api.settings.common import *
@@ -22,21 +23,91 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+    },
+    # A second connection to the same file stands in for a read replica (with zero lag)
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'TEST': {'MIRROR': 'default'},
+    },
+    # Ticket shards, used when SHARD_TICKETS is set
+    'shard1': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'shard1.sqlite3'),
+    },
+    'shard2': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'shard2.sqlite3'),
+    },
     # 'default': {
     #     'ENGINE': 'django.db.backends.postgresql',
     #     'HOST': os.environ.get('DB_HOST'),
     #     'NAME': os.environ.get('DB_NAME'),
     #     'USER': os.environ.get('DB_USER'),
     #     'PASSWORD': os.environ.get('DB_PASSWORD'),
-    # }
+    # },
+    # 'replica': {
+    #     'ENGINE': 'django.db.backends.postgresql',
+    #     'HOST': os.environ.get('DB_REPLICA_HOST'),
+    #     'NAME': os.environ.get('DB_NAME'),
+    #     'USER': os.environ.get('DB_USER'),
+    #     'PASSWORD': os.environ.get('DB_PASSWORD'),
+    #     'TEST': {'MIRROR': 'default'},
+    # },
+    # 'shard1': {
+    #     'ENGINE': 'django.db.backends.postgresql',
+    #     'HOST': os.environ.get('DB_SHARD1_HOST'),
+    #     'NAME': os.environ.get('DB_NAME'),
+    #     'USER': os.environ.get('DB_USER'),
+    #     'PASSWORD': os.environ.get('DB_PASSWORD'),
+    # },
+    # 'shard2': {
+    #     'ENGINE': 'django.db.backends.postgresql',
+    #     'HOST': os.environ.get('DB_SHARD2_HOST'),
+    #     'NAME': os.environ.get('DB_NAME'),
+    #     'USER': os.environ.get('DB_USER'),
+    #     'PASSWORD': os.environ.get('DB_PASSWORD'),
+    # },
 }
 
+DATABASE_REPLICAS = ['replica']
+
 CACHES = {  # run this to create the cache table: 'python manage.py createcachetable'
     'default': {
         'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
         'LOCATION': 'reserved_tickets',
+    },
+    # each shard's reservations are kept in its own database, under a table name of their own
+    'reservations-shard1': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'reserved_tickets_shard1',
+    },
+    'reservations-shard2': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'reserved_tickets_shard2',
+    },
+}
+
+# SHARD_TICKETS=1 spreads new contests across the primary and both shards. Set the shards up with
+# 'python manage.py migrate --database shard1' and 'python manage.py createcachetable --database
+# shard1' (and the same for shard2).
+if os.environ.get('SHARD_TICKETS'):
+    TICKET_SHARDS = {
+        'default': 'default',
+        'shard1': 'reservations-shard1',
+        'shard2': 'reservations-shard2',
     }
+
+OUTBOX_SINKS = {  # run 'python manage.py relay_outbox' to deliver events
+    'events-log': {
+        'BACKEND': 'core.outbox.FileSink',
+        'OPTIONS': {'path': os.path.join(BASE_DIR, 'outbox_events.jsonl')},
+    },
 }
 
+# eg FAULT_INJECTION='{"db": 0.3}' to see how the webhook copes with a slow database
+FAULT_INJECTION = json.loads(os.environ.get('FAULT_INJECTION', '{}'))
+
+TWILIO_VALIDATE_SIGNATURE = False
+
 DIALOGFLOW_PROJECT_ID = 'newagent-lyssbi'  # use dev chatbot here
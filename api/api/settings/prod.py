@@ -2,6 +2,7 @@
 
 import os
 
+import dj_database_url
 import django_heroku
 
 from api.settings.common import *
@@ -20,6 +21,45 @@ CACHES = {  # run this to create the cache table: 'python manage.py createcachet
     }
 }
 
+SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')  # Heroku terminates https
+
 DIALOGFLOW_PROJECT_ID = 'newagent-lyssbi'  # use prod chatbot here. TODO change.
 
 django_heroku.settings(locals())
+
+# Read replicas (eg Heroku followers), given as a comma separated list of database urls
+REPLICA_DATABASE_URLS = [
+    url for url in os.environ.get('REPLICA_DATABASE_URLS', '').split(',') if url
+]
+DATABASE_REPLICAS = [f'replica{i}' for i in range(len(REPLICA_DATABASE_URLS))]
+for alias, url in zip(DATABASE_REPLICAS, REPLICA_DATABASE_URLS):
+    DATABASES[alias] = dj_database_url.parse(url, conn_max_age=600, ssl_require=True)
+
+# Ticket shards, given as a comma separated list of database urls. New contests are spread across
+# the primary and the shards, see core/sharding.py. Set each one up with 'python manage.py migrate
+# --database shardN' and 'python manage.py createcachetable --database shardN'.
+SHARD_DATABASE_URLS = [url for url in os.environ.get('SHARD_DATABASE_URLS', '').split(',') if url]
+if SHARD_DATABASE_URLS:
+    TICKET_SHARDS = {'default': 'default'}
+for i, url in enumerate(SHARD_DATABASE_URLS, 1):
+    DATABASES[f'shard{i}'] = dj_database_url.parse(url, conn_max_age=600, ssl_require=True)
+    CACHES[f'reservations-shard{i}'] = {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': f'reserved_tickets_shard{i}',
+    }
+    TICKET_SHARDS[f'shard{i}'] = f'reservations-shard{i}'
+
+# Pooled connections, see core/db/pool.py. Each process keeps at most DB_POOL_MAX_SIZE connections
+# per database, so dynos * WEB_CONCURRENCY * DB_POOL_MAX_SIZE * 2 (ORM and cache pools) must stay
+# under the plan's connection limit. The pool keeps the connections, so Django gives them back
+# after every request (CONN_MAX_AGE=0).
+DATABASE_POOL = {
+    'MIN_SIZE': int(os.environ.get('DB_POOL_MIN_SIZE', 1)),
+    'MAX_SIZE': int(os.environ.get('DB_POOL_MAX_SIZE', 2)),
+}
+for database in DATABASES.values():
+    if database['ENGINE'].startswith('django.db.backends.postgresql'):
+        database.update(ENGINE='core.db.backends.postgresql', CONN_MAX_AGE=0, POOL=DATABASE_POOL)
+# The cache table gets its own pool, so reservations don't wait behind ORM queries
+DATABASES['cache'] = {**DATABASES['default'], 'POOL': {**DATABASE_POOL, 'MIN_SIZE': 0}}
+CACHE_DATABASE = 'cache'
@@ -20,6 +20,8 @@ CACHES = {  # run this to create the cache table: 'python manage.py createcachet
     }
 }
 
+SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')  # Heroku terminates https
+
 DIALOGFLOW_PROJECT_ID = 'newagent-lyssbi'
 
 django_heroku.settings(locals())
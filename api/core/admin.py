@@ -1,26 +1,80 @@
 """ Admin site customization """
 
-from django.contrib import admin
+from django.conf import settings
+from django.contrib import admin, messages
+from django.http import QueryDict
 
-from core import models
+from core import models, sharding
 
 
 class ContestAdmin(admin.ModelAdmin):
     """ ModelAdmin for Contest model """
-    list_display = ('name', 'draw_date', 'is_active', 'num_tickets_sold')
-    fields = ('name', 'draw_date', 'prize_pool', 'price_per_ticket', 'example_number', 'regex')
-    readonly_fields = ('regex',)
+    list_display = ('name', 'draw_date', 'is_active', 'num_tickets_sold', 'shard')
+    fields = ('name', 'draw_date', 'prize_pool', 'price_per_ticket', 'example_number', 'regex',
+              'shard', 'moving')
+    readonly_fields = ('regex', 'shard', 'moving')  # set by the move_contest command
     date_hierarchy = 'draw_date'
 
 
 class TicketAdmin(admin.ModelAdmin):
-    """ ModelAdmin for Ticket model """
+    """ ModelAdmin for Ticket model. When tickets are sharded only the tickets of the contest picked
+    in the filter are shown, from its shard.
+    """
     list_display = ('contest', 'number', 'phone_number')
     readonly_fields = ('number', 'phone_number', 'contest', 'purchase_date')
     date_hierarchy = 'purchase_date'
     list_filter = ['contest']
     search_fields = ['number', 'phone_number']
 
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if not settings.TICKET_SHARDS:
+            return queryset
+        try:
+            contest = models.Contest.objects.get(id=get_contest_filter(request))
+        except (models.Contest.DoesNotExist, ValueError):
+            return queryset.none()
+        return queryset.using(sharding.shard_for(contest)).filter(contest=contest)
+
+    def get_list_select_related(self, request):
+        # contests aren't on the shards, they can't be joined
+        return () if settings.TICKET_SHARDS else super().get_list_select_related(request)
+
+    def changelist_view(self, request, extra_context=None):
+        if settings.TICKET_SHARDS and get_contest_filter(request) is None:
+            self.message_user(request, 'Tickets are sharded by contest. Pick a contest to see its '
+                                       'tickets.', messages.INFO)
+        return super().changelist_view(request, extra_context)
+
+
+class OutboxEventAdmin(admin.ModelAdmin):
+    """ ModelAdmin for OutboxEvent model. Events are immutable. """
+    list_display = ('id', 'event_type', 'created_at')
+    readonly_fields = ('event_type', 'payload', 'created_at')
+    list_filter = ['event_type']
+    date_hierarchy = 'created_at'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+class ConsumerOffsetAdmin(admin.ModelAdmin):
+    """ ModelAdmin for ConsumerOffset model """
+    list_display = ('consumer', 'last_event_id', 'updated_at')
+
+
+def get_contest_filter(request):
+    """ The id of the contest the ticket list is filtered by. Change pages get it from the
+    changelist filters they preserve.
+    """
+    changelist_filters = QueryDict(request.GET.get('_changelist_filters', ''))
+    return request.GET.get('contest__id__exact', changelist_filters.get('contest__id__exact'))
+
 
 admin.site.register(models.Contest, ContestAdmin)
 admin.site.register(models.Ticket, TicketAdmin)
+admin.site.register(models.OutboxEvent, OutboxEventAdmin)
+admin.site.register(models.ConsumerOffset, ConsumerOffsetAdmin)
@@ -0,0 +1,135 @@
+""" A deterministic stand-in for the Dialogflow agent, used by channels that talk to users directly
+(see core.views.twilio). Messages are parsed with a few keyword rules and each user's place in the
+purchase flow is kept in the cache:
+
+    IDLE -"comprar"-> CHOOSING_CONTEST -contest-> CHOOSING_NUMBER -number-> CONFIRMING -"si"-> IDLE
+
+"mis numeros" lists the user's tickets and "cancelar" goes back to IDLE from any state.
+"""
+
+import re
+import unicodedata
+
+from django.conf import settings
+from django.core.cache import cache
+
+from core import messages, purchases
+from core.models import Contest
+
+
+IDLE = 'idle'
+CHOOSING_CONTEST = 'choosing_contest'
+CHOOSING_NUMBER = 'choosing_number'
+CONFIRMING = 'confirming'
+
+# keywords are matched against the normalized message, see normalize
+LIST_TICKETS_KEYWORDS = ('mis numeros', 'mis tiquetes', 'mis tickets', 'ver numeros',
+                         'ver tiquetes')
+PURCHASE_KEYWORDS = ('comprar', 'compra', 'jugar')
+CANCEL_KEYWORDS = ('cancelar', 'salir')
+YES_KEYWORDS = ('si', 'dale', 'ok', 'confirmar', 'confirmo', 'claro', 'yes')
+NO_KEYWORDS = ('no', 'nop', 'nel')
+
+HELP = 'Hola! 👋 Escribí "comprar" para comprar un tiquete de lotería o "mis numeros" para ver ' \
+       'los tiquetes que ya compraste.'
+CANCELLED = 'Listo, cancelamos la compra. Escribí "comprar" cuando querás intentar de nuevo.'
+YES_OR_NO = 'Respondé "si" para confirmar la compra o "no" para cancelarla.'
+
+
+def handle_message(phone_number: str, text: str) -> str:
+    """ Advances the user's conversation with their message. Returns the reply. The phone number
+    must be eligible to buy lottery (see purchases.parse_phone_number).
+    """
+    state = cache.get(get_state_key(phone_number)) or {'step': IDLE}
+    words = normalize(text)
+    if words in CANCEL_KEYWORDS:
+        reply, state = (CANCELLED if state['step'] != IDLE else HELP), {'step': IDLE}
+    elif any(keyword in words for keyword in LIST_TICKETS_KEYWORDS):
+        # doesn't change the state, the user can carry on with a purchase afterwards
+        reply = messages.tickets_message(purchases.get_user_tickets(phone_number))
+    elif words in PURCHASE_KEYWORDS or (state['step'] == IDLE
+                                        and set(words.split()) & set(PURCHASE_KEYWORDS)):
+        reply, state = start_purchase()
+    elif state['step'] == CHOOSING_CONTEST:
+        reply, state = choose_contest(state, words)
+    elif state['step'] == CHOOSING_NUMBER:
+        reply, state = choose_number(state, text.strip(), phone_number)
+    elif state['step'] == CONFIRMING:
+        reply, state = confirm(state, words, phone_number)
+    else:
+        reply = HELP
+    cache.set(get_state_key(phone_number), state, timeout=settings.CONVERSATION_TIMEOUT)
+    return reply
+
+
+def start_purchase():
+    """ Lists the active contests for the user to pick one """
+    contests = list(Contest.objects.get_active_contests())
+    if not contests:
+        return messages.NO_CONTESTS, {'step': IDLE}
+    reply = messages.contests_message(contests, numbered=True)
+    return reply, {'step': CHOOSING_CONTEST, 'contests': [c.id for c in contests]}
+
+
+def choose_contest(state: dict, words: str):
+    """ Picks the contest by its number in the list or by name """
+    contest_id = None
+    if words.isdigit() and 1 <= int(words) <= len(state['contests']):
+        contest_id = state['contests'][int(words) - 1]
+    elif words:
+        contests = Contest.objects.filter(id__in=state['contests'])
+        contest_id = next((c.id for c in contests if words in normalize(c.name)), None)
+    if contest_id is None:
+        num_contests = len(state['contests'])
+        return f'No entendí 🤔. Respondé con el número del sorteo (1 a {num_contests}).', state
+    try:
+        contest = purchases.get_active_contest(contest_id)
+    except Contest.DoesNotExist:  # drawn since it was listed
+        return messages.CONTEST_UNAVAILABLE, {'step': IDLE}
+    return messages.pick_number_message(contest), {'step': CHOOSING_NUMBER, 'contest': contest.id}
+
+
+def choose_number(state: dict, ticket_number: str, phone_number: str):
+    """ Reserves the ticket and asks the user to confirm the purchase """
+    try:
+        contest = purchases.get_active_contest(state['contest'])
+    except Contest.DoesNotExist:
+        return messages.CONTEST_UNAVAILABLE, {'step': IDLE}
+    try:
+        purchases.reserve_ticket(contest, ticket_number, phone_number)
+    except purchases.TicketUnavailable as e:
+        return f'{e} Escribí otro número.', state
+    except purchases.PurchaseError as e:
+        return str(e), state
+    reply = f'¿Deseas confirmar la compra del numero "{ticket_number}" por ' \
+            f'₡{contest.price_per_ticket} para el sorteo {contest.name}? Te lo cobraríamos a tu ' \
+            f'cuenta de celular. Respondé "si" o "no".'
+    return reply, {'step': CONFIRMING, 'contest': contest.id, 'ticket_number': ticket_number}
+
+
+def confirm(state: dict, words: str, phone_number: str):
+    """ Buys the reserved ticket if the user said yes """
+    answer = words.split()[0] if words else ''  # eg 'si, confirmo'
+    if answer in NO_KEYWORDS:
+        return CANCELLED, {'step': IDLE}
+    if answer not in YES_KEYWORDS:
+        return YES_OR_NO, state
+    try:
+        contest = purchases.buy_ticket(state['contest'], state['ticket_number'], phone_number)
+    except Contest.DoesNotExist:
+        return messages.CONTEST_UNAVAILABLE, {'step': IDLE}
+    except purchases.PurchaseError as e:
+        return str(e), {'step': IDLE}
+    return messages.purchase_success_message(contest, state['ticket_number']), {'step': IDLE}
+
+
+def normalize(text: str) -> str:
+    """ Lowercases the text, strips accents and punctuation and collapses whitespace """
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(re.sub(r'[^\w\s-]', ' ', text).split())
+
+
+def get_state_key(phone_number: str) -> str:
+    """ Gives the cache key holding the user's conversation state """
+    return f'conversation--{phone_number}'
@@ -0,0 +1,15 @@
+""" PostgreSQL backend with pooled connections, see core.db.pool """
+
+from django.db.backends.postgresql import base
+
+from core.db.pool import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+    """ Pooled django.db.backends.postgresql DatabaseWrapper """
+
+    def get_new_connection(self, conn_params):
+        connection = super().get_new_connection(conn_params)
+        # Django only sets it when it opens a connection, not when one comes from the pool
+        self.isolation_level = connection.isolation_level
+        return connection
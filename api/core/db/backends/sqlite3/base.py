@@ -0,0 +1,11 @@
+""" SQLite backend with pooled connections, see core.db.pool. Mostly useful to try the pool locally:
+opening a SQLite connection is cheap.
+"""
+
+from django.db.backends.sqlite3 import base
+
+from core.db.pool import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+    """ Pooled django.db.backends.sqlite3 DatabaseWrapper """
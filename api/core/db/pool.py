@@ -0,0 +1,263 @@
+""" Connection pooling for Django database backends (Django 3.0 has none). Use one of the backends
+in core.db.backends as ENGINE and configure the pool with a POOL dict next to it:
+
+    'default': {
+        'ENGINE': 'core.db.backends.postgresql',
+        'CONN_MAX_AGE': 0,  # give the connection back to the pool after every request
+        'POOL': {'MIN_SIZE': 1, 'MAX_SIZE': 4},
+        ...
+    }
+
+Each process keeps a pool per database alias, shared by its threads. Closing a Django connection
+gives it back to the pool instead of closing it. Connections are checked with 'SELECT 1' before
+being handed out, and idle connections above MIN_SIZE are closed after MAX_IDLE seconds.
+"""
+
+import logging
+import os
+import threading
+import time
+
+from django.db import DEFAULT_DB_ALIAS
+
+
+logger = logging.getLogger('testlogger')  # this is the logger defined by django-heroku
+
+POOL_DEFAULTS = {
+    'MIN_SIZE': 0,  # connections opened up front and kept even when idle
+    'MAX_SIZE': 10,  # connections open at once, in use or idle
+    'MAX_IDLE': 300,  # seconds an idle connection above MIN_SIZE is kept. None keeps them.
+    'TIMEOUT': 2,  # seconds to wait for a connection when MAX_SIZE are in use
+    'HEALTH_CHECK': True,  # check connections before handing them out
+    'METRICS_INTERVAL': 60,  # seconds between logs of the pool metrics. None disables them.
+}
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class PoolExhausted(Exception):
+    """ Raised when no connection was freed within the pool's timeout """
+
+
+class ConnectionPool:
+    """ A thread-safe pool of DB-API connections. Connections are opened with the connect callable
+    given to get and fill, so a pool can be used by any backend.
+    """
+
+    def __init__(self, alias: str = DEFAULT_DB_ALIAS, min_size: int = 0, max_size: int = 10,
+                 max_idle: float = 300, timeout: float = 2, health_check=None,
+                 metrics_interval: float = None):
+        self.alias = alias
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self.health_check = health_check  # callable telling if a connection is usable, or None
+        self.metrics_interval = metrics_interval
+        self.idle = []  # (connection, time it was given back), most recently used last
+        self.in_use = 0
+        self.lock = threading.Condition()
+        self.metrics = dict.fromkeys(('opened', 'closed', 'checkouts', 'health_check_failures',
+                                      'waits', 'timeouts'), 0)
+        self.metrics.update(connect_seconds=0.0, wait_seconds=0.0)
+        self.last_report = time.monotonic()
+
+    @property
+    def size(self) -> int:
+        """ Connections open, in use or idle """
+        return len(self.idle) + self.in_use
+
+    def get(self, connect):
+        """ Hands out an idle connection, or opens one if there are fewer than max_size. Waits for
+        one to be given back otherwise. Raises PoolExhausted after `timeout` seconds.
+        """
+        with self.lock:
+            self.trim()
+            if not self.idle and self.size >= self.max_size:
+                self.wait()
+            self.metrics['checkouts'] += 1
+            self.in_use += 1
+            connection = self.idle.pop()[0] if self.idle else None
+        try:
+            if connection is not None and not self.is_usable(connection):
+                self.close(connection)
+                connection = None
+            return connection if connection is not None else self.open(connect)
+        except BaseException:
+            with self.lock:
+                self.in_use -= 1
+                self.lock.notify()
+            raise
+
+    def put(self, connection):
+        """ Gives back a connection that is no longer used """
+        with self.lock:
+            self.in_use -= 1
+            self.idle.append((connection, time.monotonic()))
+            self.lock.notify()
+            self.trim()
+        self.report()
+
+    def discard(self, connection):
+        """ Closes a connection that was handed out instead of giving it back, eg after an error """
+        with self.lock:
+            self.in_use -= 1
+            self.lock.notify()
+        self.close(connection)
+
+    def fill(self, connect):
+        """ Opens connections until there are min_size """
+        while True:
+            with self.lock:
+                if self.size >= self.min_size:
+                    return
+                self.in_use += 1  # counted while it's being opened
+            try:
+                connection = self.open(connect)
+            except BaseException:
+                with self.lock:
+                    self.in_use -= 1
+                raise
+            self.put(connection)
+
+    def start_reaper(self):
+        """ Trims the pool every so often in a background thread, so that idle processes also close
+        their idle connections
+        """
+        def reap():
+            while True:
+                time.sleep(max(self.max_idle / 2, 1))
+                with self.lock:
+                    self.trim()
+        threading.Thread(target=reap, name=f'pool-reaper-{self.alias}', daemon=True).start()
+
+    def clear(self):
+        """ Closes the idle connections """
+        with self.lock:
+            while self.idle:
+                self.close(self.idle.pop()[0])
+
+    def trim(self):
+        """ Closes the connections that have been idle for longer than max_idle, keeping min_size.
+        Call with the lock held.
+        """
+        if self.max_idle is None:
+            return
+        expired = time.monotonic() - self.max_idle
+        while self.idle and self.size > self.min_size and self.idle[0][1] < expired:
+            self.close(self.idle.pop(0)[0])
+
+    def wait(self):
+        """ Waits for a connection to be given back. Call with the lock held. """
+        self.metrics['waits'] += 1
+        start = time.monotonic()
+        freed = self.lock.wait_for(lambda: self.idle or self.size < self.max_size, self.timeout)
+        self.metrics['wait_seconds'] += time.monotonic() - start
+        if not freed:
+            self.metrics['timeouts'] += 1
+            raise PoolExhausted(f'No connection to "{self.alias}" was freed in {self.timeout}s '
+                                f'({self.max_size} in use)')
+
+    def open(self, connect):
+        """ Opens a new connection """
+        start = time.monotonic()
+        connection = connect()
+        with self.lock:  # reentrant
+            self.metrics['connect_seconds'] += time.monotonic() - start
+            self.metrics['opened'] += 1
+        return connection
+
+    def close(self, connection):
+        """ Closes a connection that left the pool """
+        with self.lock:
+            self.metrics['closed'] += 1
+        try:
+            connection.close()
+        except Exception:  # pylint: disable=broad-except
+            pass  # it's being dropped anyway, eg because the server closed it
+
+    def is_usable(self, connection) -> bool:
+        """ Runs the health check on a connection about to be handed out """
+        if self.health_check is None or self.health_check(connection):
+            return True
+        with self.lock:
+            self.metrics['health_check_failures'] += 1
+        return False
+
+    def stats(self) -> dict:
+        """ The pool's current size and its counters since it was created """
+        with self.lock:
+            return {'size': self.size, 'in_use': self.in_use, 'idle': len(self.idle),
+                    **self.metrics}
+
+    def report(self):
+        """ Logs the pool's stats every metrics_interval seconds """
+        with self.lock:
+            if (self.metrics_interval is None
+                    or time.monotonic() - self.last_report < self.metrics_interval):
+                return
+            self.last_report = time.monotonic()
+        stats = ' '.join(f'{k}={round(v, 3)}' for k, v in self.stats().items())
+        logger.info('Connection pool "%s" (pid %d): %s', self.alias, os.getpid(), stats)
+
+
+class PooledDatabaseWrapperMixin:
+    """ Makes a DatabaseWrapper take its connections from the alias' pool and give them back on
+    close. Goes before the backend's DatabaseWrapper in the bases.
+    """
+
+    def get_new_connection(self, conn_params):
+        try:
+            return get_pool(self).get(lambda: super(PooledDatabaseWrapperMixin, self)
+                                      .get_new_connection(conn_params))
+        except PoolExhausted as e:
+            raise self.Database.OperationalError(str(e)) from e  # django.db.OperationalError
+
+    def _close(self):
+        pool = get_pool(self)
+        # a connection in a transaction or that raised errors isn't safe to hand out again
+        if self.in_atomic_block or self.errors_occurred or not self.autocommit:
+            pool.discard(self.connection)
+        else:
+            pool.put(self.connection)
+
+    @classmethod
+    def check_connection(cls, connection) -> bool:
+        """ Whether a raw connection still works. Used as the pool's health check. """
+        try:
+            cursor = connection.cursor()
+            cursor.execute('SELECT 1')
+            cursor.close()
+        except cls.Database.Error:
+            return False
+        return True
+
+
+def get_pool(wrapper) -> ConnectionPool:
+    """ The pool of the wrapper's alias in this process, created (and filled) on first use. Pools
+    of a parent process (eg the gunicorn master) aren't used: connections can't be shared.
+    """
+    key = (os.getpid(), wrapper.alias)
+    if (pool := _pools.get(key)) is None:
+        with _pools_lock:
+            if (pool := _pools.get(key)) is None:
+                config = {**POOL_DEFAULTS, **wrapper.settings_dict.get('POOL', {})}
+                pool = ConnectionPool(
+                    wrapper.alias, min_size=config['MIN_SIZE'], max_size=config['MAX_SIZE'],
+                    max_idle=config['MAX_IDLE'], timeout=config['TIMEOUT'],
+                    health_check=wrapper.check_connection if config['HEALTH_CHECK'] else None,
+                    metrics_interval=config['METRICS_INTERVAL'])
+                params = wrapper.get_connection_params()
+                pool.fill(lambda: super(PooledDatabaseWrapperMixin, wrapper)
+                          .get_new_connection(params))
+                if pool.max_idle is not None:
+                    pool.start_reaper()
+                _pools[key] = pool
+    return pool
+
+
+def get_pool_stats() -> dict:
+    """ {alias: stats} for the pools of this process """
+    return {alias: pool.stats() for (pid, alias), pool in list(_pools.items())
+            if pid == os.getpid()}
@@ -0,0 +1,71 @@
+""" Per-request time budget. Dialogflow drops webhook answers that take longer than ~5 seconds, so
+the webhook runs under a deadline and every DB, cache and payment call checks it first. When too
+little time is left to make the call and still answer, DeadlineExceeded is raised and the webhook
+asks Dialogflow to resume the turn instead of timing out.
+
+settings.FAULT_INJECTION ({'db' | 'cache' | 'payment': seconds}) adds latency to those calls to
+test this. Only enable it in development and tests.
+"""
+
+import contextlib
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+
+
+_state = threading.local()
+
+
+class DeadlineExceeded(Exception):
+    """ Raised when there isn't enough time left to make a call and still answer in time """
+
+
+@contextlib.contextmanager
+def enforce(seconds: float):
+    """ Runs the block under a deadline `seconds` from now. Every SQL query is checked. """
+    _state.end = time.monotonic() + seconds
+    try:
+        with contextlib.ExitStack() as stack:
+            for conn in connections.all():
+                stack.enter_context(conn.execute_wrapper(_check_query))
+            yield
+    finally:
+        _state.end = None
+
+
+@contextlib.contextmanager
+def shielded():
+    """ Disables the deadline inside the block, for work that must finish once started (eg saving
+    the ticket of a user who already paid)
+    """
+    _state.shielded = getattr(_state, 'shielded', 0) + 1
+    try:
+        yield
+    finally:
+        _state.shielded -= 1
+
+
+def remaining() -> float:
+    """ Seconds left before the deadline (infinite if there is none) """
+    end = getattr(_state, 'end', None)
+    return float('inf') if end is None else end - time.monotonic()
+
+
+def check(operation: str):
+    """ Call before each DB, cache or payment call. Raises DeadlineExceeded if less than
+    settings.WEBHOOK_DEADLINE_RESERVE seconds are left.
+    """
+    if getattr(_state, 'end', None) is None:
+        return
+    if not getattr(_state, 'shielded', 0) and remaining() < settings.WEBHOOK_DEADLINE_RESERVE:
+        raise DeadlineExceeded(f'{remaining():.2f}s left before {operation} call')
+    if latency := settings.FAULT_INJECTION.get(operation):
+        time.sleep(latency)
+
+
+def _check_query(execute, sql, params, many, context):
+    """ Database execute wrapper, see enforce """
+    check('db')
+    return execute(sql, params, many, context)
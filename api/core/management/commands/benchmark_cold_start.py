@@ -0,0 +1,112 @@
+""" Defines a command to benchmark the time a new web worker takes to answer its first request """
+
+import io
+import json
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+WEBHOOK_PATH = '/dialogflow/webhook'  # not reversed, that would load the URLconf before timing
+BENCHMARK_PHONE_NUMBER = '+50600000000'
+PHASES = ('import', 'warm_up', 'first_request', 'second_request')
+
+# Runs in a fresh interpreter, simulating a new gunicorn worker. Nothing of the app or Django is
+# imported before the import timing starts.
+WORKER_SCRIPT = '''
+import json, sys, time
+timings = {}
+start = time.perf_counter()
+from api.wsgi import application
+timings['import'] = time.perf_counter() - start
+from core.management.commands.benchmark_cold_start import webhook_request
+if sys.argv[1] == 'warm':
+    from core.warmup import warm_up
+    timings['warm_up'] = warm_up()
+for phase in ('first_request', 'second_request'):
+    start = time.perf_counter()
+    status = webhook_request(application)
+    timings[phase] = time.perf_counter() - start
+timings['status'] = status
+print(json.dumps(timings))
+'''
+
+
+class Command(BaseCommand):
+    help = 'Measures the time to first request of a new worker, with and without warm-up. Uses ' \
+           'the configured database, which needs to be migrated.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5,
+                            help='Number of workers to start for each mode (default 5)')
+
+    def handle(self, *args, **options):
+        results = {}
+        for mode in ('cold', 'warm'):
+            runs = [self.run_worker(mode) for _ in range(options['runs'])]
+            results[mode] = {phase: statistics.median(r[phase] for r in runs)
+                             for phase in PHASES if phase in runs[0]}
+
+        self.stdout.write(f'Median over {options["runs"]} new workers (ms):')
+        self.stdout.write(f'{"":16}{"no warm-up":>12}{"warm-up":>12}')
+        for phase in PHASES:
+            cold, warm = (results[mode].get(phase) for mode in ('cold', 'warm'))
+            self.stdout.write(f'{phase:16}{format_ms(cold):>12}{format_ms(warm):>12}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Time to first request: {format_ms(results["cold"]["first_request"])} ms cold, '
+            f'{format_ms(results["warm"]["first_request"])} ms after warm-up'))
+
+    def run_worker(self, mode: str) -> dict:
+        """ Starts a fresh interpreter that imports the WSGI app and sends it two webhook requests.
+        Returns the timings of each phase.
+        """
+        result = subprocess.run([sys.executable, '-c', WORKER_SCRIPT, mode],
+                                cwd=settings.BASE_DIR, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise CommandError(f'Worker failed:\n{result.stderr.strip()}')
+        timings = json.loads(result.stdout.strip().splitlines()[-1])
+        if not timings['status'].startswith('200'):
+            raise CommandError(f'Webhook answered "{timings["status"]}". Is the database migrated?')
+        return timings
+
+
+def webhook_request(application) -> str:
+    """ Sends a list_tickets turn straight to the WSGI application. Returns the response status. """
+    body = json.dumps({
+        'queryResult': {'action': 'list_tickets', 'parameters': {}},
+        'originalDetectIntentRequest': {
+            'payload': {'data': {'From': f'whatsapp:{BENCHMARK_PHONE_NUMBER}'}}
+        },
+    }).encode()
+    host = settings.ALLOWED_HOSTS[0]
+    environ = {
+        'REQUEST_METHOD': 'POST',
+        'SCRIPT_NAME': '',
+        'PATH_INFO': WEBHOOK_PATH,
+        'QUERY_STRING': '',
+        'SERVER_NAME': host,
+        'SERVER_PORT': '443',
+        'HTTP_HOST': host,
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'https',
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': False,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    statuses = []
+    response = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+    b''.join(response)
+    response.close()
+    return statuses[0]
+
+
+def format_ms(seconds) -> str:
+    """ Formats a duration in seconds as milliseconds, or '-' if there is none """
+    return '-' if seconds is None else f'{seconds * 1000:.1f}'
@@ -0,0 +1,100 @@
+""" Defines a command to benchmark webhook turns with and without pooled database connections """
+
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.utils import ConnectionHandler
+
+from core.db.pool import get_pool, get_pool_stats
+from core.models import Contest
+
+
+POOLED_ENGINES = {
+    'django.db.backends.postgresql': 'core.db.backends.postgresql',
+    'django.db.backends.postgresql_psycopg2': 'core.db.backends.postgresql',
+    'django.db.backends.sqlite3': 'core.db.backends.sqlite3',
+}
+UNPOOLED_ENGINES = {pooled: engine for engine, pooled in POOLED_ENGINES.items()}
+POOLED_ALIAS = 'benchmark-pooled'  # the pool is per alias, this keeps it apart from the app's
+
+
+class Command(BaseCommand):
+    help = 'Measures connection setup cost and the latency of webhook-like turns (open a ' \
+           'connection, load the active contests, close it as Django does after a request) with ' \
+           'and without a connection pool. Uses the given database, which needs to be migrated. ' \
+           'Run it against postgres (eg the commented settings in dev.py) for realistic numbers, ' \
+           'SQLite connections are much cheaper to open.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default',
+                            help='Alias of the database to benchmark (default "default")')
+        parser.add_argument('--turns', type=int, default=200,
+                            help='Number of turns for each mode (default 200)')
+
+    def handle(self, *args, **options):
+        settings_dict = connections[options['database']].settings_dict
+        if settings_dict['ENGINE'] not in {**POOLED_ENGINES, **UNPOOLED_ENGINES}:
+            raise CommandError(f'Unsupported engine {settings_dict["ENGINE"]}')
+        unpooled = {**settings_dict, 'ENGINE': UNPOOLED_ENGINES.get(settings_dict['ENGINE'],
+                                                                     settings_dict['ENGINE'])}
+        # the pool is kept small: a webhook turn holds one connection at a time
+        pooled = {**unpooled, 'ENGINE': POOLED_ENGINES[unpooled['ENGINE']],
+                  'POOL': {'MIN_SIZE': 1, 'MAX_SIZE': 1, 'METRICS_INTERVAL': None}}
+        handler = ConnectionHandler({'default': unpooled, POOLED_ALIAS: pooled})
+        sql, params = Contest.objects.get_active_contests().query.sql_with_params()
+
+        setup = self.time_connection_setup(handler['default'], options['turns'])
+        results = {}
+        for mode in ('default', POOLED_ALIAS):
+            connection = handler[mode]
+            connection.cursor().close()  # opens (and fills) the pool before timing
+            connection.close()
+            results[mode] = [self.time_turn(connection, sql, params)
+                             for _ in range(options['turns'])]
+
+        self.stdout.write(f'Connection setup: median {format_ms(statistics.median(setup))} ms, '
+                          f'p99 {format_ms(percentile(setup, 99))} ms')
+        self.stdout.write(f'Over {options["turns"]} turns (ms):')
+        self.stdout.write(f'{"":8}{"no pool":>12}{"pool":>12}')
+        for name, p in (('p50', 50), ('p90', 90), ('p99', 99)):
+            unpooled_ms, pooled_ms = (format_ms(percentile(results[mode], p))
+                                      for mode in ('default', POOLED_ALIAS))
+            self.stdout.write(f'{name:8}{unpooled_ms:>12}{pooled_ms:>12}')
+        stats = get_pool_stats()[POOLED_ALIAS]
+        self.stdout.write(self.style.SUCCESS(
+            f'The pool opened {stats["opened"]} connection(s) for {stats["checkouts"]} checkouts, '
+            f'{stats["health_check_failures"]} failed their health check'))
+        handler.close_all()
+        get_pool(handler[POOLED_ALIAS]).clear()
+
+    def time_connection_setup(self, connection, samples: int) -> list:
+        """ Times opening (and closing) a connection """
+        timings = []
+        for _ in range(samples):
+            start = time.perf_counter()
+            connection.ensure_connection()
+            timings.append(time.perf_counter() - start)
+            connection.close()
+        return timings
+
+    def time_turn(self, connection, sql: str, params) -> float:
+        """ Times a turn: a query on a connection closed at the end, as with CONN_MAX_AGE=0 """
+        start = time.perf_counter()
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            cursor.fetchall()
+        connection.close()
+        return time.perf_counter() - start
+
+
+def percentile(values: list, p: float) -> float:
+    """ The p-th percentile of the values (nearest rank) """
+    values = sorted(values)
+    return values[max(round(p / 100 * len(values)) - 1, 0)]
+
+
+def format_ms(seconds: float) -> str:
+    """ Formats a duration in seconds as milliseconds """
+    return f'{seconds * 1000:.2f}'
@@ -0,0 +1,99 @@
+""" Defines a command to move a contest's tickets to another shard """
+
+import collections
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core import sharding
+from core.models import Contest, Ticket
+from core.routers import read_from_primary
+
+
+class Command(BaseCommand):
+    help = 'Moves the tickets of a contest to another shard (see core/sharding.py). The tickets ' \
+           'are copied while purchases keep working, then purchases of the contest are blocked ' \
+           '(users are asked to try again in a few minutes) for --grace seconds and while the ' \
+           'tickets bought meanwhile are copied, so no ticket can be sold twice. Reservations ' \
+           'made before the move are dropped, so move contests when few users are buying.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('contest', type=int, help='Id of the contest to move')
+        parser.add_argument('shard', help='Database alias of the shard to move it to')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of tickets copied at a time (default 1000)')
+        parser.add_argument('--grace', type=float, default=10,
+                            help='Seconds to wait for purchases that started before purchases were '
+                                 'blocked (default 10)')
+
+    def handle(self, *args, **options):
+        target = options['shard']
+        if target not in sharding.get_shards():
+            raise CommandError(f'Unknown shard "{target}". The shards are: '
+                               f'{", ".join(sharding.get_shards())}')
+        with read_from_primary():
+            try:
+                contest = Contest.objects.get(id=options['contest'])
+            except Contest.DoesNotExist:
+                raise CommandError(f'There is no contest with id {options["contest"]}')
+        source = sharding.shard_for(contest)
+        if source == target:
+            raise CommandError(f'{contest} is already on {target}')
+        if Ticket.objects.using(target).filter(contest=contest).exists():
+            raise CommandError(f'{target} already has tickets of {contest}. Delete them first, '
+                               f'eg if a previous move was interrupted.')
+
+        # copy, block purchases, copy the tickets bought meanwhile until the source has no more,
+        # then switch and unblock at once. While blocked no purchase checks availability on either
+        # shard. The source keeps its tickets until the end, so it's safe to stop at any point.
+        copied, last_id = self.copy_tickets(contest, source, target, 0, options['batch_size'])
+        Contest.objects.filter(id=contest.id).update(moving=True)
+        try:
+            self.stdout.write(f'Copied {copied} tickets. Blocked purchases of {contest}, waiting '
+                              f'{options["grace"]:g}s for purchases in flight.')
+            time.sleep(options['grace'])
+            late = 0
+            # purchases slower than the grace period may still be writing to the source
+            while True:
+                count, last_id = self.copy_tickets(contest, source, target, last_id,
+                                                   options['batch_size'])
+                if not count:
+                    break
+                late += count
+        except BaseException:
+            Contest.objects.filter(id=contest.id).update(moving=False)  # still on the source
+            raise
+        Contest.objects.filter(id=contest.id).update(shard=target, moving=False)
+        tickets = Ticket.objects.using(source).filter(contest=contest)
+        deleted, _ = tickets.filter(id__lte=last_id).delete()  # only what was copied
+        if left := tickets.count():
+            raise CommandError(
+                f'{left} tickets of {contest} were bought on {source} after they were all copied '
+                f'and were not moved to {target}. Copy them over by hand (ids above {last_id}) and '
+                f'use a longer --grace next time.')
+        self.stdout.write(self.style.SUCCESS(
+            f'Moved {copied + late} tickets of {contest} from {source} to {target} ({late} bought '
+            f'during the move). Deleted {deleted} tickets from {source}.'))
+
+    def copy_tickets(self, contest: Contest, source: str, target: str, after_id: int,
+                     batch_size: int):
+        """ Copies the contest's tickets with an id above after_id from source to target. Tickets
+        get new ids on the target. Returns the number of tickets copied and the last id copied.
+        """
+        copied = 0
+        tickets = Ticket.objects.using(source).filter(contest=contest).order_by('id')
+        while batch := list(tickets.filter(id__gt=after_id)[:batch_size]):
+            after_id = batch[-1].id
+            purchase_dates = collections.defaultdict(list)
+            for ticket in batch:
+                purchase_dates[ticket.purchase_date].append(ticket.number)
+                ticket.pk = None
+            with transaction.atomic(using=target):
+                Ticket.objects.using(target).bulk_create(batch)
+                # purchase_date is set on insert, put back the original ones
+                for purchase_date, numbers in purchase_dates.items():
+                    Ticket.objects.using(target).filter(
+                        contest=contest, number__in=numbers).update(purchase_date=purchase_date)
+            copied += len(batch)
+        return copied, after_id
@@ -0,0 +1,61 @@
+""" Defines a command to profile how long it takes to import the WSGI application """
+
+import re
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+IMPORTTIME_LINE_REGEX = r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)'
+
+
+class Command(BaseCommand):
+    help = 'Imports a module (api.wsgi by default) in a fresh interpreter and lists the slowest ' \
+           'imports'
+
+    def add_arguments(self, parser):
+        parser.add_argument('module', nargs='?', default='api.wsgi',
+                            help='Dotted path of the module to import')
+        parser.add_argument('--limit', type=int, default=25,
+                            help='Number of modules to list (default 25)')
+        parser.add_argument('--self', action='store_true', dest='sort_by_self',
+                            help='Sort by time spent in the module itself instead of cumulative')
+        parser.add_argument('--setup', action='store_true',
+                            help='Run django.setup() first. Needed for modules that import models')
+
+    def handle(self, *args, **options):
+        module = options['module']
+        if not re.fullmatch(r'[\w.]+', module):
+            raise CommandError(f'"{module}" is not a valid module path')
+        code = f'import {module}'
+        if options['setup']:
+            code = f'import django; django.setup(); {code}'
+        # a fresh interpreter, since every module this command needs is already imported here
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                                cwd=settings.BASE_DIR, capture_output=True, text=True)
+        if result.returncode != 0:
+            error = '\n'.join(line for line in result.stderr.splitlines()
+                              if not line.startswith('import time:'))
+            raise CommandError(f'Could not import {module}:\n{error}')
+        imports = parse_importtime(result.stderr)
+        total = next(cumulative for _, cumulative, name in reversed(imports) if name == module)
+
+        self.stdout.write(f'Importing {module} took {total / 1000:.0f} ms ({len(imports)} modules)')
+        self.stdout.write(f'{"self ms":>9} {"cumul. ms":>9}  module')
+        key = (lambda i: i[0]) if options['sort_by_self'] else (lambda i: i[1])
+        imports = sorted(imports, key=key, reverse=True)[:options['limit']]
+        for self_us, cumulative_us, name in imports:
+            self.stdout.write(f'{self_us / 1000:9.1f} {cumulative_us / 1000:9.1f}  {name}')
+
+
+def parse_importtime(output: str) -> list:
+    """ Parses the output of `python -X importtime` into (self us, cumulative us, module) tuples, in
+    the order the imports finished
+    """
+    imports = []
+    for line in output.splitlines():
+        if match := re.match(IMPORTTIME_LINE_REGEX, line):
+            imports.append((int(match.group(1)), int(match.group(2)), match.group(4)))
+    return imports
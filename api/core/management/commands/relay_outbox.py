@@ -0,0 +1,47 @@
+""" Defines a command that relays outbox events to the consumers in settings.OUTBOX_SINKS """
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import outbox, sharding
+
+
+class Command(BaseCommand):
+    help = 'Delivers outbox events to every configured consumer, in id order (but for late ' \
+           'commits) and at least once'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Maximum number of events per delivery (default 100)')
+        parser.add_argument('--interval', type=float, default=1,
+                            help='Seconds to wait when there are no new events (default 1)')
+        parser.add_argument('--once', action='store_true',
+                            help='Deliver every pending event and exit instead of polling. Exits '
+                                 'with an error if some could not be delivered.')
+
+    def handle(self, *args, **options):
+        sinks = outbox.get_sinks()
+        if not sinks:
+            raise CommandError('No consumers configured. Add them to settings.OUTBOX_SINKS.')
+        while True:
+            delivered = 0
+            failed = []
+            for consumer, sink in sinks.items():
+                for shard in sharding.get_shards():
+                    try:
+                        count = outbox.relay(consumer, sink, options['batch_size'], using=shard)
+                    except Exception as e:  # pylint: disable=broad-except
+                        # the batch will be retried, don't hold up the other consumers and shards
+                        self.stderr.write(f'Delivery to {consumer} from {shard} failed: {e!r}')
+                        failed.append(f'{consumer} from {shard}')
+                        continue
+                    if count:
+                        self.stdout.write(f'Delivered {count} events from {shard} to {consumer}')
+                    delivered += count
+            if not delivered:
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        if failed:
+            raise CommandError(f'Events are still pending, delivery failed to {", ".join(failed)}')
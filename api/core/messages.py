@@ -0,0 +1,46 @@
+""" Messages shown to users, shared by every channel. Errors from the purchase flow carry their own
+message, see core.purchases.
+"""
+
+from core.models import Contest
+
+
+NOT_ELIGIBLE = 'Lo sentimos pero tu número de celular no califica para hacer compras de lotería.'
+CONTEST_UNAVAILABLE = 'Error: El sorteo que querés jugar no está disponible.'
+NO_CONTESTS = 'Desafortunadamente, no hay sorteos disponibles en este momento.'
+NO_TICKETS = 'Todavía no has comprado tiquetes para los próximos sorteos.'
+
+
+def tickets_message(tickets) -> str:
+    """ Lists the user's tickets """
+    if not tickets:
+        return NO_TICKETS
+    message = 'Tenes los siguientes numeros:\n'
+    for t in tickets:
+        message += f'    🎟 Serie {t.number} para {t.contest}\n'
+    return message
+
+
+def contests_message(contests: list, numbered: bool = False) -> str:
+    """ Lists the contests the user can play. With numbered=True each one gets a number the user
+    can answer with.
+    """
+    if not contests:
+        return NO_CONTESTS
+    message = 'En cual sorteo estás interesado? Las opciones son:\n'
+    for i, c in enumerate(contests, 1):
+        bullet = f'{i}.' if numbered else '•'
+        message += f'    {bullet} {c}: por un premio de ₡{c.prize_pool}\n'
+    return message
+
+
+def pick_number_message(contest: Contest) -> str:
+    """ Asks the user for the number they want """
+    return (f'¿Qué número te gustaría comprar? En este sorteo los números tienen el siguiente '
+            f'formato {contest.example_number}, y cuestan ₡{contest.price_per_ticket} cada uno')
+
+
+def purchase_success_message(contest: Contest, ticket_number: str) -> str:
+    """ Confirms a successful purchase """
+    return (f'Listo! Tu compra del numero "{ticket_number}" para el sorteo "{contest}" fue '
+            f'exitosa. Buena suerte! 🍀')
@@ -0,0 +1,24 @@
+# Generated by Django 3.0.14 on 2026-10-19 08:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contest',
+            name='shard',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='ticket',
+            name='contest',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='tickets_sold', to='core.Contest'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.14 on 2026-10-19 08:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_sharding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='consumeroffset',
+            name='gaps',
+            field=models.TextField(default='{}'),
+        ),
+    ]
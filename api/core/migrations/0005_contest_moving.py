@@ -0,0 +1,18 @@
+# Generated by Django 3.0.14 on 2026-10-19 08:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_outbox_gaps'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contest',
+            name='moving',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -6,6 +6,7 @@ import datetime
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.dispatch import receiver
 from django.utils import timezone
 from phonenumber_field.modelfields import PhoneNumberField
 
@@ -38,9 +39,20 @@ class Contest(models.Model):
     price_per_ticket = models.IntegerField()  # in colones
     regex = models.CharField(max_length=255)
     example_number = models.CharField(max_length=255, blank=True)  # an eg of a valid ticket number
+    shard = models.CharField(max_length=255, blank=True)  # db holding its tickets, see sharding.py
+    moving = models.BooleanField(default=False)  # purchases are blocked, see move_contest
 
     objects = ContestManager()
 
+    def save(self, *args, **kwargs):
+        """ Places new contests on one of settings.TICKET_SHARDS, by id """
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        if adding and not self.shard and settings.TICKET_SHARDS:
+            shards = list(settings.TICKET_SHARDS)
+            self.shard = shards[self.id % len(shards)]
+            Contest.objects.filter(id=self.id).update(shard=self.shard)
+
     def is_active(self) -> bool:
         """ Whether the contest is active (ie hasn't been drawn yet) """
         cutoff = timezone.now() + datetime.timedelta(hours=settings.HOURS_THRESHOLD)
@@ -79,7 +91,9 @@ class Contest(models.Model):
 
 class Ticket(models.Model):
     """ Represents a ticket that has been sold/purchased """
-    contest = models.ForeignKey(Contest, on_delete=models.CASCADE, related_name='tickets_sold')
+    # no db constraint: the ticket may live in another database than its contest, see sharding
+    contest = models.ForeignKey(Contest, on_delete=models.CASCADE, related_name='tickets_sold',
+                                db_constraint=False)
     number = models.CharField(max_length=255)  # remember to validate at the serializer level
     phone_number = PhoneNumberField()
     purchase_date = models.DateField(auto_now_add=True)
@@ -93,5 +107,40 @@ class Ticket(models.Model):
     def __str__(self):
         return f'{self.contest}: {self.number}'
 
+
+@receiver(models.signals.pre_delete, sender=Contest)
+def delete_sharded_tickets(sender, instance, using, **kwargs):  # pylint: disable=unused-argument
+    """ The cascade only reaches tickets in the contest's database. Deletes the rest. """
+    if instance.shard and instance.shard != using:
+        instance.tickets_sold.all().delete()
+
+
+class OutboxEvent(models.Model):
+    """ An event (eg a ticket purchase) waiting to be relayed to downstream consumers. Written in
+    the same transaction as the change it describes, see core.outbox.
+    """
+    event_type = models.CharField(max_length=255)
+    payload = models.TextField()  # json
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return f'{self.event_type} #{self.id}'
+
+
+class ConsumerOffset(models.Model):
+    """ The id of the last outbox event that was delivered to a consumer, and the lower ids that
+    weren't committed yet when it was (see core.outbox.relay)
+    """
+    consumer = models.CharField(max_length=255, unique=True)
+    last_event_id = models.IntegerField(default=0)
+    gaps = models.TextField(default='{}')  # json {event id: timestamp of the relay that skipped it}
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.consumer}: {self.last_event_id}'
+
 # class WinningNumber(models.Model):
 #    contest = models.ForeignKey(Contest, on_delete=models.CASCADE, related_name='winning_numbers')
@@ -0,0 +1,146 @@
+""" Transactional outbox. Events are written to the OutboxEvent table in the same transaction as the
+change they describe, and relayed in id order to the sinks configured in settings.OUTBOX_SINKS (see
+the relay_outbox command). Events committed after higher ids were relayed come late, out of order
+(see relay). Delivery is at-least-once: a consumer's offset only moves forward after its sink
+accepted a batch, so consumers must tolerate seeing an event twice (use the event's shard and id).
+
+Ticket events are written on the contest's shard, in the transaction that saves the ticket (see
+core.sharding). Each shard's outbox is relayed on its own: events are in order within a shard.
+"""
+
+import json
+import os
+import queue
+import time
+import urllib.request
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.module_loading import import_string
+
+from core.models import ConsumerOffset, OutboxEvent
+from core.routers import read_from_primary
+
+
+# event types
+TICKET_RESERVED = 'ticket.reserved'
+TICKET_PURCHASED = 'ticket.purchased'
+TICKET_PURCHASE_FAILED = 'ticket.purchase_failed'  # paid but the ticket couldn't be created
+PAYMENT_SUCCEEDED = 'payment.succeeded'
+PAYMENT_FAILED = 'payment.failed'
+
+
+def record_event(event_type: str, using: str = DEFAULT_DB_ALIAS, **payload) -> OutboxEvent:
+    """ Adds an event to the outbox of the `using` database. Call it inside the transaction that
+    makes the change, on the same database, so the event is only published if the change is
+    committed.
+    """
+    return OutboxEvent.objects.using(using).create(event_type=event_type,
+                                                   payload=json.dumps(payload))
+
+
+def serialize(event: OutboxEvent) -> dict:
+    """ The representation of an event that sinks receive """
+    return {
+        'id': event.id,
+        'shard': event._state.db,
+        'type': event.event_type,
+        'created_at': event.created_at.isoformat(),
+        'payload': json.loads(event.payload),
+    }
+
+
+def relay(consumer: str, sink, batch_size: int = 100, using: str = DEFAULT_DB_ALIAS) -> int:
+    """ Delivers the next batch of events (in id order) in the outbox of the `using` database to
+    the consumer's sink and moves its offset past them. Returns the number of events delivered.
+
+    Ids are handed out when a row is inserted, not when it is committed, so a slow transaction may
+    commit an event with a lower id than one that was already relayed. The ids skipped over are
+    kept in the offset's gaps and looked up on every batch: their events are delivered, ahead of
+    the batch, once they show up. A gap is given up after settings.OUTBOX_GAP_TIMEOUT seconds (eg
+    its transaction was rolled back), timed with the relay's clock.
+    """
+    now = time.time()
+    with read_from_primary():
+        offset, _ = ConsumerOffset.objects.get_or_create(consumer=get_offset_name(consumer, using))
+        saved_gaps = {int(event_id): skipped_at
+                      for event_id, skipped_at in json.loads(offset.gaps).items()}
+        gaps = {event_id: skipped_at for event_id, skipped_at in saved_gaps.items()
+                if now - skipped_at < settings.OUTBOX_GAP_TIMEOUT}
+        outbox = OutboxEvent.objects.using(using)
+        late = list(outbox.filter(id__in=gaps)) if gaps else []
+        events = list(outbox.filter(id__gt=offset.last_event_id)[:batch_size])
+    for event in late:
+        del gaps[event.id]
+    last_event_id = offset.last_event_id
+    for event in events:
+        if last_event_id:  # a new consumer starts at the first event there is
+            gaps.update(dict.fromkeys(range(last_event_id + 1, event.id), now))
+        last_event_id = event.id
+    if not late and not events and gaps == saved_gaps:
+        return 0
+    if late or events:
+        sink.deliver([serialize(e) for e in late + events])  # raises if it wasn't accepted
+    offset.last_event_id = last_event_id
+    offset.gaps = json.dumps(gaps)
+    offset.save(update_fields=['last_event_id', 'gaps', 'updated_at'])
+    return len(late) + len(events)
+
+
+def get_offset_name(consumer: str, using: str) -> str:
+    """ The name of the consumer's offset in the outbox of the `using` database """
+    return consumer if using == DEFAULT_DB_ALIAS else f'{consumer}@{using}'
+
+
+def get_sinks() -> dict:
+    """ Instantiates the sinks in settings.OUTBOX_SINKS. Returns a {consumer name: sink} dict """
+    return {
+        consumer: import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+        for consumer, config in settings.OUTBOX_SINKS.items()
+    }
+
+
+# sinks
+
+class FileSink:
+    """ Appends events to a file, one json object per line """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def deliver(self, events: list):
+        with open(self.path, 'a') as f:
+            for event in events:
+                f.write(json.dumps(event) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class HTTPSink:
+    """ POSTs each batch of events as {"events": [...]} to a url. Any non 2xx answer is a failure
+    and the batch will be sent again.
+    """
+
+    def __init__(self, url: str, timeout: float = 10, headers: dict = None):
+        self.url = url
+        self.timeout = timeout
+        self.headers = {'Content-Type': 'application/json', **(headers or {})}
+
+    def deliver(self, events: list):
+        data = json.dumps({'events': events}).encode()
+        request = urllib.request.Request(self.url, data=data, headers=self.headers, method='POST')
+        with urllib.request.urlopen(request, timeout=self.timeout):  # raises HTTPError on 4xx/5xx
+            pass
+
+
+class QueueSink:
+    """ Puts events on an in-process queue. Stands in for a message broker in development and tests
+    """
+    queues = {}
+
+    def __init__(self, name: str = 'default'):
+        self.queue = self.queues.setdefault(name, queue.Queue())
+
+    def deliver(self, events: list):
+        for event in events:
+            self.queue.put(event)
@@ -0,0 +1,198 @@
+""" Ticket purchase logic shared by every channel users can buy from (Dialogflow, Twilio). Errors
+are raised as PurchaseError subclasses whose message can be shown to the user as is.
+"""
+
+import logging
+import re
+
+from django.conf import settings
+from django.db import transaction
+from django.db.utils import IntegrityError
+
+from core import deadline, outbox, sharding
+from core.models import Contest, Ticket
+from core.routers import pin_to_primary, read_from_primary
+
+
+PHONE_NUMBER_REGEX = r'\+[0-9]{6,15}'  # determines which phone numbers are eligible to buy lottery
+
+
+logger = logging.getLogger('testlogger')  # this is the logger defined by django-heroku
+
+
+class PurchaseError(Exception):
+    """ A ticket couldn't be reserved or bought """
+    message = 'Hubo un error procesando tu compra.'
+
+    def __init__(self, message: str = None):
+        super().__init__(message or self.message)
+
+
+class InvalidTicketNumber(PurchaseError):
+    """ The ticket number doesn't match the contest's format """
+
+    def __init__(self, contest: Contest):
+        super().__init__(f'El número no está en el formato correcto. Escribí el número que querés '
+                         f'en este formato: {contest.example_number}')
+
+
+class TicketUnavailable(PurchaseError):
+    """ The ticket was already sold """
+    message = 'Desafortunadamente, el tiquete que querés ya no está disponible 😢'
+
+
+class TicketReserved(PurchaseError):
+    """ The ticket is reserved by another user """
+    message = 'Desafortunadamente, el tiquete que querés está reservado por otro usuario. ' \
+              'Intentá de nuevo en 15 mins. para ver si se liberó.'
+
+
+class ContestMoving(PurchaseError):
+    """ The contest's tickets are being moved to another shard (see the move_contest command) """
+    message = 'Estamos haciendo mantenimiento en este sorteo. Por favor intentá de nuevo en unos ' \
+              'minutos.'
+
+
+class PaymentFailed(PurchaseError):
+    """ The user couldn't be charged """
+    message = 'Desafortunadamente, hubo un problema procesando el pago. Por favor intenta más ' \
+              'tarde.'
+
+
+class TicketNotCreated(PurchaseError):
+    """ The user paid but the ticket couldn't be saved """
+    message = 'Hubo un error reservando tu numero. Estamos investigandolo y te contactaremos ' \
+              'pronto.'
+
+
+def parse_phone_number(string: str):
+    """ Extracts the phone number from a sender id (eg 'whatsapp:+50688888888'). Returns None if
+    there is none or it isn't eligible to buy lottery.
+    """
+    if match := re.search(PHONE_NUMBER_REGEX, string):
+        return match.group()
+
+
+def get_user_tickets(phone_number: str):
+    """ The user's tickets for active contests, with their contest """
+    if settings.TICKET_SHARDS:
+        contests = Contest.objects.get_active_contests()
+        return sharding.get_tickets(contests, phone_number=phone_number)
+    # single query: filter on active contests in SQL and join the contest for __str__
+    return Ticket.objects.filter(
+        phone_number=phone_number,
+        contest__in=Contest.objects.get_active_contests()
+    ).select_related('contest')
+
+
+def get_active_contest(contest_id) -> Contest:
+    """ Returns the active contest with the given id. Raises Contest.DoesNotExist if there is none.
+    """
+    return Contest.objects.get_active_contests().get(id=contest_id)
+
+
+def check_availability(contest: Contest, ticket_number: str, phone_number: str):
+    """ Checks that the user can buy the ticket: the contest isn't being moved, and the ticket is
+    valid, not sold and not reserved by someone else. Raises ContestMoving, InvalidTicketNumber,
+    TicketUnavailable or TicketReserved.
+    """
+    if contest.moving:  # its tickets are on two shards, neither has them all
+        raise ContestMoving()
+    try:
+        ticket_available = contest.number_is_available(ticket_number)
+    except ValueError:
+        raise InvalidTicketNumber(contest)
+    if not ticket_available:
+        raise TicketUnavailable()
+    cache_hit = get_reservation(ticket_number, contest)
+    if cache_hit is not None and cache_hit != phone_number:
+        raise TicketReserved()
+
+
+def reserve_ticket(contest: Contest, ticket_number: str, phone_number: str):
+    """ Reserves the ticket for the user while they confirm the purchase. Raises the errors of
+    check_availability.
+    """
+    check_availability(contest, ticket_number, phone_number)
+    reserve(ticket_number, contest, phone_number)
+    outbox.record_event(outbox.TICKET_RESERVED, using=sharding.shard_for(contest),
+                        **ticket_details(contest, ticket_number, phone_number))
+
+
+def buy_ticket(contest_id, ticket_number: str, phone_number: str) -> Contest:
+    """ Charges the user and saves their ticket. Returns the contest. Raises Contest.DoesNotExist,
+    the errors of check_availability, PaymentFailed or TicketNotCreated.
+    """
+    # redundancy check that ticket is avaiable. Done on the primary, replicas may be lagging.
+    with read_from_primary():
+        contest = get_active_contest(contest_id)
+        check_availability(contest, ticket_number, phone_number)
+    # set cache again in case the reservation had expired
+    reserve(ticket_number, contest, phone_number)
+
+    payment_succeded = charge(phone_number, contest.price_per_ticket)
+    details = ticket_details(contest, ticket_number, phone_number)
+    shard = sharding.shard_for(contest)  # where the ticket and its events are saved
+    # TODO identify failure reason and notify slack if it was a system issue
+    if not payment_succeded:
+        logger.info('Payment failed for phone number %s', phone_number)
+        with deadline.shielded():
+            outbox.record_event(outbox.PAYMENT_FAILED, using=shard, **details)
+        raise PaymentFailed()
+    try:
+        # the ticket and its events are committed together, or not at all. The user already
+        # paid, so this is finished even if it runs past the deadline.
+        with deadline.shielded(), transaction.atomic(using=shard):
+            outbox.record_event(outbox.PAYMENT_SUCCEEDED, using=shard, **details)
+            contest.tickets_sold.create(number=ticket_number, phone_number=phone_number)
+            outbox.record_event(outbox.TICKET_PURCHASED, using=shard, **details)
+    except IntegrityError:
+        logger.critical('Failed to create ticket %s (contest %s) for user %s who already paid',
+                        ticket_number, str(contest), phone_number)
+        with deadline.shielded(), transaction.atomic(using=shard):
+            outbox.record_event(outbox.PAYMENT_SUCCEEDED, using=shard, **details)
+            outbox.record_event(outbox.TICKET_PURCHASE_FAILED, using=shard, **details)
+        # TODO add slack notif (as an outbox consumer)
+        raise TicketNotCreated()
+    with deadline.shielded():
+        pin_to_primary(phone_number)  # so list_tickets shows the new ticket right away
+    return contest
+
+
+def get_reservation(ticket_number: str, contest: Contest):
+    """ Returns the phone number that reserved the ticket, or None if it isn't reserved """
+    deadline.check('cache')
+    return sharding.get_reservations_cache(contest).get(get_cache_key(ticket_number, contest))
+
+
+def reserve(ticket_number: str, contest: Contest, phone_number: str):
+    """ Reserves the ticket for the user for settings.RESERVATION_THRESHOLD seconds """
+    deadline.check('cache')
+    reservations = sharding.get_reservations_cache(contest)
+    reservations.set(get_cache_key(ticket_number, contest), phone_number,
+                     timeout=settings.RESERVATION_THRESHOLD)
+
+
+def charge(phone_number: str, amount: int) -> bool:
+    """ Charges the amount (in colones) to the user's phone bill. Returns True if the payment
+    went through.
+    """
+    deadline.check('payment')
+    print(f'SIMULATING CALL TO PAYMENT API. CHARGING ₡{amount} TO {phone_number}')
+    return True  # simulating success of payment
+
+
+def ticket_details(contest: Contest, ticket_number: str, phone_number: str) -> dict:
+    """ The payload of outbox events about a ticket """
+    return {
+        'contest': contest.id,
+        'contest_name': contest.name,
+        'ticket_number': ticket_number,
+        'phone_number': phone_number,
+        'price': contest.price_per_ticket,
+    }
+
+
+def get_cache_key(ticket_number: str, contest: Contest) -> str:
+    """ Gives a unique string to identify a ticket in the cache """
+    return f'{contest.id}--{ticket_number}'
@@ -0,0 +1,122 @@
+""" Database routers. Sends tickets to their contest's shard, read-only queries to replicas and
+everything else to the primary
+"""
+
+import contextlib
+import random
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from core import sharding
+from core.models import Contest, Ticket
+
+
+_state = threading.local()
+
+# models with tables on the shards. Contests stay on the primary, their table is only there for the
+# migrations creating Ticket's foreign key.
+SHARDED_MODELS = ('contest', 'ticket', 'outboxevent')
+
+# read right after they're written (eg the session and user of an admin login), so never from a
+# lagging replica
+PRIMARY_APP_LABELS = ('sessions', 'auth', 'contenttypes')
+
+
+class ShardRouter:
+    """ Routes tickets to the shard of their contest, and the reservations cache of each shard to
+    its database (see core.sharding). Queries on the primary are left to the next router.
+
+    Ticket queries are only routed when they carry their contest, eg contest.tickets_sold or
+    ticket.save(). Others (eg Ticket.objects.filter(...)) need sharding.get_tickets or using().
+    """
+
+    def db_for_read(self, model, **hints):
+        return self.get_shard(model, hints.get('instance'))
+
+    def db_for_write(self, model, **hints):
+        return self.get_shard(model, hints.get('instance'))
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == DEFAULT_DB_ALIAS or db not in settings.TICKET_SHARDS:
+            return None
+        if app_label == 'django_cache':
+            return sharding.get_reservation_tables().get(hints['model']._meta.db_table) == db
+        return app_label == 'core' and model_name in SHARDED_MODELS
+
+    def get_shard(self, model, instance):
+        """ The shard for a query on the model, or None to leave it to the next router """
+        shard = None
+        if model._meta.app_label == 'django_cache':
+            shard = sharding.get_reservation_tables().get(model._meta.db_table)
+        elif model is Ticket and isinstance(instance, Contest):
+            shard = sharding.shard_for(instance)
+        elif model is Ticket and isinstance(instance, Ticket) and instance.contest_id is not None:
+            shard = sharding.shard_for(instance.contest)
+        return None if shard == DEFAULT_DB_ALIAS else shard
+
+
+class ReplicaRouter:
+    """ Routes reads to one of settings.DATABASE_REPLICAS and writes to the primary. Reads are kept
+    on the primary inside transactions, while read_from_primary() is active (eg for users who just
+    bought a ticket), and for sessions, users and permissions (see PRIMARY_APP_LABELS). The cache
+    table goes to settings.CACHE_DATABASE, a connection to the primary that may have a pool of its
+    own (see core.db.pool).
+    """
+
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        if model._meta.app_label == 'django_cache':  # DatabaseCache, holds reservations
+            return settings.CACHE_DATABASE
+        if (not replicas
+                or model._meta.app_label in PRIMARY_APP_LABELS
+                or model._meta.label == settings.AUTH_USER_MODEL
+                or getattr(_state, 'primary_reads', 0)
+                or connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label == 'django_cache':
+            return settings.CACHE_DATABASE
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.DATABASE_REPLICAS
+
+
+@contextlib.contextmanager
+def read_from_primary():
+    """ Sends every read made inside the block to the primary """
+    _state.primary_reads = getattr(_state, 'primary_reads', 0) + 1
+    try:
+        yield
+    finally:
+        _state.primary_reads -= 1
+
+
+def pin_to_primary(phone_number: str):
+    """ Keeps the user's reads on the primary for settings.REPLICA_STICKINESS seconds so they see
+    their own writes even if the replicas are lagging behind
+    """
+    if settings.DATABASE_REPLICAS:
+        cache.set(get_pin_key(phone_number), True, timeout=settings.REPLICA_STICKINESS)
+
+
+def sticky_reads(phone_number):
+    """ Returns a context manager that routes reads to the primary if the user was pinned to it """
+    if (settings.DATABASE_REPLICAS and phone_number is not None
+            and cache.get(get_pin_key(phone_number)) is not None):
+        return read_from_primary()
+    return contextlib.nullcontext()
+
+
+def get_pin_key(phone_number: str) -> str:
+    """ Gives the cache key that marks a user as pinned to the primary """
+    return f'primary-pin--{phone_number}'
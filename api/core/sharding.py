@@ -0,0 +1,73 @@
+""" Contest-based sharding. Each contest's tickets, reservations and ticket outbox events live on
+one of the databases in settings.TICKET_SHARDS ({database alias: cache alias for its reservations}).
+Contests themselves, and everything else, stay on the primary.
+
+A new contest is placed on a shard by id and the shard is saved in Contest.shard, so adding shards
+doesn't move existing contests (see the move_contest command). Contests with a blank shard (eg the
+ones created before sharding was turned on) keep their tickets on the primary. With no shards
+configured everything lives on the primary.
+
+Queries on tickets of a single contest are routed by core.routers.ShardRouter when they go through
+the contest (eg contest.tickets_sold). Queries across contests, like a user's tickets, must use
+get_tickets, which fans out to every shard involved.
+"""
+
+import collections
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.db import DEFAULT_DB_ALIAS
+
+from core.models import Contest, Ticket
+
+
+DATABASE_CACHE = 'django.core.cache.backends.db.DatabaseCache'
+
+
+def shard_for(contest: Contest) -> str:
+    """ The database alias holding the contest's tickets """
+    return contest.shard or DEFAULT_DB_ALIAS
+
+
+def get_shards() -> list:
+    """ Every database holding tickets. The primary always does. """
+    return [DEFAULT_DB_ALIAS] + [s for s in settings.TICKET_SHARDS if s != DEFAULT_DB_ALIAS]
+
+
+def get_reservations_cache(contest: Contest):
+    """ The cache holding the reservations of the contest's tickets """
+    return caches[settings.TICKET_SHARDS.get(shard_for(contest), DEFAULT_CACHE_ALIAS)]
+
+
+def get_reservation_tables() -> dict:
+    """ {table: shard} for the shards whose reservations are kept in a DatabaseCache. Each of these
+    needs its own table name, it's how the router tells them apart.
+    """
+    return {
+        settings.CACHES[alias]['LOCATION']: shard
+        for shard, alias in settings.TICKET_SHARDS.items()
+        if settings.CACHES[alias]['BACKEND'] == DATABASE_CACHE
+    }
+
+
+def tickets_on(shard: str):
+    """ A Ticket queryset on the shard. Queries on the primary's tickets are left to the routers (ie
+    may go to a replica).
+    """
+    return Ticket.objects.all() if shard == DEFAULT_DB_ALIAS else Ticket.objects.using(shard)
+
+
+def get_tickets(contests, **filters) -> list:
+    """ The tickets of the contests that match the filters. Makes one query per shard holding any
+    of the contests, one after the other. Each ticket's contest is set from `contests`.
+    """
+    contests = {c.id: c for c in contests}
+    contest_ids = collections.defaultdict(list)
+    for contest in contests.values():
+        contest_ids[shard_for(contest)].append(contest.id)
+    tickets = []
+    for shard, ids in contest_ids.items():
+        for ticket in tickets_on(shard).filter(contest_id__in=ids, **filters):
+            ticket.contest = contests[ticket.contest_id]
+            tickets.append(ticket)
+    return tickets
@@ -0,0 +1,158 @@
+""" Tests for outbox.py """
+
+import datetime
+import io
+import json
+import os
+import queue
+import tempfile
+
+from django.core.management import CommandError, call_command
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from core import outbox
+from core.models import Contest, ConsumerOffset, OutboxEvent
+from core.tests.utils import dialogflow_payload, post_webhook
+from core.views.dialogflow import webhook
+
+
+class FailingSink:
+    """ A sink whose consumer is down """
+
+    def deliver(self, events):
+        raise ConnectionError('consumer unavailable')
+
+
+class PrimaryFailingSink(outbox.QueueSink):
+    """ A sink whose consumer rejects the events of the primary """
+
+    def deliver(self, events):
+        if any(event['shard'] == 'default' for event in events):
+            raise ConnectionError('consumer rejected the batch')
+        super().deliver(events)
+
+
+@override_settings(TICKET_SHARDS={})  # SHARD_TICKETS may be set, see test_sharding for shards
+class OutboxTests(TestCase):
+    """ Tests for recording and relaying outbox events """
+
+    def setUp(self):
+        self.sink = outbox.QueueSink(name=self.id())
+
+    def drain(self) -> list:
+        """ Returns the events the sink received """
+        events = []
+        while True:
+            try:
+                events.append(self.sink.queue.get_nowait())
+            except queue.Empty:
+                return events
+
+    def test_event_rolled_back_with_transaction(self):
+        try:
+            with transaction.atomic():
+                outbox.record_event(outbox.TICKET_PURCHASED, ticket_number='1234')
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_relay_in_order_and_in_batches(self):
+        for i in range(5):
+            outbox.record_event(outbox.TICKET_RESERVED, ticket_number=str(i))
+        self.assertEqual(outbox.relay('analytics', self.sink, batch_size=3), 3)
+        self.assertEqual(outbox.relay('analytics', self.sink, batch_size=3), 2)
+        self.assertEqual(outbox.relay('analytics', self.sink, batch_size=3), 0)
+        events = self.drain()
+        self.assertEqual([e['payload']['ticket_number'] for e in events], ['0', '1', '2', '3', '4'])
+        self.assertEqual(ConsumerOffset.objects.get(consumer='analytics').last_event_id,
+                         events[-1]['id'])
+
+    def test_consumers_have_independent_offsets(self):
+        outbox.record_event(outbox.TICKET_RESERVED, ticket_number='1')
+        outbox.relay('analytics', self.sink)
+        outbox.record_event(outbox.TICKET_RESERVED, ticket_number='2')
+        self.assertEqual(outbox.relay('accounting', self.sink), 2)
+        self.assertEqual(outbox.relay('analytics', self.sink), 1)
+
+    def test_failed_delivery_is_retried(self):
+        outbox.record_event(outbox.TICKET_PURCHASED, ticket_number='1234')
+        with self.assertRaises(ConnectionError):
+            outbox.relay('accounting', FailingSink())
+        self.assertEqual(outbox.relay('accounting', self.sink), 1)
+        self.assertEqual(self.drain()[0]['payload'], {'ticket_number': '1234'})
+
+    def test_late_commit_is_relayed(self):
+        first, late, last = [outbox.record_event(outbox.TICKET_RESERVED, ticket_number=str(i))
+                             for i in range(3)]
+        late_id = late.id
+        late.delete()  # its transaction hasn't committed when the relay runs
+        self.assertEqual(outbox.relay('accounting', self.sink), 2)
+        self.assertEqual(outbox.relay('accounting', self.sink), 0)
+        OutboxEvent.objects.create(id=late_id, event_type=late.event_type, payload=late.payload)
+        self.assertEqual(outbox.relay('accounting', self.sink), 1)
+        self.assertEqual([e['id'] for e in self.drain()], [first.id, last.id, late_id])
+        self.assertEqual(json.loads(ConsumerOffset.objects.get(consumer='accounting').gaps), {})
+
+    @override_settings(OUTBOX_GAP_TIMEOUT=0)
+    def test_gap_is_given_up(self):
+        _, rolled_back, _ = [outbox.record_event(outbox.TICKET_RESERVED, ticket_number=str(i))
+                             for i in range(3)]
+        rolled_back.delete()
+        outbox.relay('accounting', self.sink)
+        self.assertEqual(outbox.relay('accounting', self.sink), 0)
+        self.assertEqual(json.loads(ConsumerOffset.objects.get(consumer='accounting').gaps), {})
+
+    def test_file_sink(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'events.jsonl')
+        outbox.record_event(outbox.TICKET_PURCHASED, ticket_number='1234')
+        outbox.relay('events-log', outbox.FileSink(path))
+        with open(path) as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual([e['type'] for e in lines], [outbox.TICKET_PURCHASED])
+
+    def test_purchase_records_events(self):
+        contest = Contest.objects.create(
+            name='Lotto', draw_date=timezone.now() + datetime.timedelta(days=3),
+            prize_pool=1000000, price_per_ticket=1000, regex=r'^\d{4}$')
+        post_webhook(self.client, dialogflow_payload(webhook.INITIATE_PURCHASE, contest=contest.id,
+                                                     ticket_number='1234'))
+        post_webhook(self.client, dialogflow_payload(webhook.CONFIRM_PURCHASE, contest=contest.id,
+                                                     ticket_number='1234'))
+        outbox.relay('accounting', self.sink)
+        events = self.drain()
+        self.assertEqual([e['type'] for e in events], [
+            outbox.TICKET_RESERVED, outbox.PAYMENT_SUCCEEDED, outbox.TICKET_PURCHASED])
+        self.assertEqual(events[-1]['payload']['ticket_number'], '1234')
+        self.assertEqual(events[-1]['payload']['contest'], contest.id)
+
+
+@override_settings(TICKET_SHARDS={'default': 'default', 'shard1': 'reservations-shard1'})
+class RelayOutboxCommandTests(TestCase):
+    """ Tests for the relay_outbox command """
+    databases = {'default', 'shard1'}
+
+    def relay(self, sinks: dict):
+        with override_settings(OUTBOX_SINKS=sinks):
+            call_command('relay_outbox', once=True, stdout=io.StringIO(), stderr=io.StringIO())
+
+    def test_failing_shard_does_not_hold_up_the_others(self):
+        outbox.record_event(outbox.TICKET_PURCHASED, ticket_number='1111')
+        outbox.record_event(outbox.TICKET_PURCHASED, using='shard1', ticket_number='2222')
+        name = self.id()
+        sinks = {'analytics': {'BACKEND': 'core.tests.test_outbox.PrimaryFailingSink',
+                               'OPTIONS': {'name': name}}}
+        with self.assertRaisesMessage(CommandError, 'delivery failed to analytics from default'):
+            self.relay(sinks)
+        event = outbox.QueueSink(name).queue.get_nowait()
+        self.assertEqual((event['shard'], event['payload']['ticket_number']), ('shard1', '2222'))
+
+    def test_once_delivers_everything(self):
+        outbox.record_event(outbox.TICKET_PURCHASED, ticket_number='1111')
+        name = self.id()
+        self.relay({'analytics': {'BACKEND': 'core.outbox.QueueSink', 'OPTIONS': {'name': name}}})
+        self.assertEqual(outbox.QueueSink(name).queue.qsize(), 1)
@@ -0,0 +1,151 @@
+""" Tests for db/pool.py and the pooled backends """
+
+import os
+import tempfile
+import threading
+
+from django.core.cache import caches
+from django.db import OperationalError
+from django.db.utils import ConnectionHandler
+from django.test import SimpleTestCase, override_settings
+
+from core.db.pool import ConnectionPool, PoolExhausted, get_pool, get_pool_stats
+from core.routers import ReplicaRouter
+
+
+class FakeConnection:
+    """ Stands in for a DB-API connection """
+
+    def __init__(self):
+        self.closed = False
+        self.usable = True
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    """ Tests for ConnectionPool """
+
+    def make_pool(self, **kwargs) -> ConnectionPool:
+        kwargs.setdefault('health_check', lambda connection: connection.usable)
+        return ConnectionPool('test', **kwargs)
+
+    def test_reuses_connections(self):
+        pool = self.make_pool()
+        connection = pool.get(FakeConnection)
+        pool.put(connection)
+        self.assertIs(pool.get(FakeConnection), connection)
+        self.assertEqual(pool.stats()['opened'], 1)
+        self.assertEqual(pool.stats()['checkouts'], 2)
+
+    def test_fill(self):
+        pool = self.make_pool(min_size=2)
+        pool.fill(FakeConnection)
+        self.assertEqual(pool.stats()['idle'], 2)
+        self.assertEqual(pool.stats()['opened'], 2)
+
+    def test_health_check(self):
+        pool = self.make_pool()
+        connection = pool.get(FakeConnection)
+        pool.put(connection)
+        connection.usable = False  # eg the server closed it
+        new_connection = pool.get(FakeConnection)
+        self.assertIsNot(new_connection, connection)
+        self.assertTrue(connection.closed)
+        stats = pool.stats()
+        self.assertEqual((stats['health_check_failures'], stats['size']), (1, 1))
+
+    def test_waits_for_a_connection(self):
+        pool = self.make_pool(max_size=1, timeout=5)
+        connection = pool.get(FakeConnection)
+        threading.Timer(0.05, pool.put, [connection]).start()
+        self.assertIs(pool.get(FakeConnection), connection)
+        self.assertEqual(pool.stats()['waits'], 1)
+
+    def test_timeout(self):
+        pool = self.make_pool(max_size=1, timeout=0.01)
+        pool.get(FakeConnection)
+        with self.assertRaises(PoolExhausted):
+            pool.get(FakeConnection)
+        self.assertEqual(pool.stats()['timeouts'], 1)
+
+    def test_discard(self):
+        pool = self.make_pool(max_size=1, timeout=0.01)
+        connection = pool.get(FakeConnection)
+        pool.discard(connection)
+        self.assertTrue(connection.closed)
+        self.assertIsNot(pool.get(FakeConnection), connection)  # the slot was freed
+
+    def test_failed_connect_frees_its_slot(self):
+        pool = self.make_pool(max_size=1, timeout=0.01)
+
+        def connect():
+            raise ConnectionError('server is down')
+        with self.assertRaises(ConnectionError):
+            pool.get(connect)
+        self.assertEqual(pool.stats()['size'], 0)
+        pool.get(FakeConnection)
+
+    def test_idle_connections_are_closed(self):
+        pool = self.make_pool(min_size=1, max_idle=0)
+        connections = [pool.get(FakeConnection) for _ in range(3)]
+        for connection in connections:
+            pool.put(connection)
+        # the last one given back is kept to honor min_size
+        self.assertEqual([c.closed for c in connections], [True, True, False])
+        self.assertEqual(pool.stats()['size'], 1)
+
+
+class PooledBackendTests(SimpleTestCase):
+    """ Tests the pooled SQLite backend with a database of its own """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.connections = ConnectionHandler({
+            'default': {
+                'ENGINE': 'core.db.backends.sqlite3',
+                'NAME': os.path.join(directory.name, 'db.sqlite3'),
+                'POOL': {'MIN_SIZE': 1, 'MAX_SIZE': 1, 'TIMEOUT': 0.01},
+            },
+        })
+        self.connection = self.connections['default']
+        self.connection.alias = f'pool-test-{self.id()}'  # each test gets its own pool
+        self.addCleanup(lambda: get_pool(self.connection).clear())
+        self.addCleanup(self.connections.close_all)
+
+    def raw_connection(self):
+        """ Opens the Django connection and returns the DB-API connection it got from the pool """
+        self.connection.ensure_connection()
+        return self.connection.connection
+
+    def test_close_gives_the_connection_back(self):
+        raw_connection = self.raw_connection()
+        self.connection.close()
+        self.assertEqual(get_pool(self.connection).stats()['idle'], 1)
+        self.assertIs(self.raw_connection(), raw_connection)
+        self.assertEqual(get_pool_stats()[self.connection.alias]['opened'], 1)
+
+    def test_connection_in_transaction_is_discarded(self):
+        raw_connection = self.raw_connection()
+        self.connection.set_autocommit(False)  # eg a request that errored out mid-transaction
+        self.connection.close()
+        self.assertIsNot(self.raw_connection(), raw_connection)
+
+    def test_exhausted_pool(self):
+        self.raw_connection()
+        other = ConnectionHandler({'default': self.connection.settings_dict})['default']
+        other.alias = self.connection.alias  # another thread's connection to the same database
+        with self.assertRaisesMessage(OperationalError, 'No connection'):
+            other.ensure_connection()
+
+
+class CacheDatabaseTests(SimpleTestCase):
+    """ Tests that the cache table can be given a connection (and pool) of its own """
+
+    @override_settings(CACHE_DATABASE='cache')
+    def test_cache_database(self):
+        model = caches['default'].cache_model_class
+        self.assertEqual(ReplicaRouter().db_for_read(model), 'cache')
+        self.assertEqual(ReplicaRouter().db_for_write(model), 'cache')
@@ -0,0 +1,99 @@
+""" Tests for routers.py """
+
+import contextlib
+import datetime
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from core.models import Contest, Ticket
+from core.routers import ReplicaRouter, pin_to_primary, read_from_primary, sticky_reads
+from core.tests.utils import dialogflow_payload, post_webhook
+from core.views.dialogflow import webhook
+
+
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], CACHES=LOCMEM_CACHE, REPLICA_STICKINESS=30)
+class ReplicaRouterTests(SimpleTestCase):
+    """ Tests for ReplicaRouter and its helpers """
+
+    def setUp(self):
+        self.router = ReplicaRouter()
+
+    def test_reads_go_to_replica(self):
+        self.assertEqual(self.router.db_for_read(Ticket), 'replica')
+        self.assertEqual(self.router.db_for_read(Contest), 'replica')
+
+    def test_sessions_and_users_are_read_from_primary(self):
+        for model in (Session, Permission, ContentType, get_user_model()):
+            self.assertEqual(self.router.db_for_read(model), DEFAULT_DB_ALIAS)
+
+    def test_writes_go_to_primary(self):
+        self.assertEqual(self.router.db_for_write(Ticket), DEFAULT_DB_ALIAS)
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_no_replicas_configured(self):
+        self.assertEqual(self.router.db_for_read(Ticket), DEFAULT_DB_ALIAS)
+
+    def test_read_from_primary(self):
+        with read_from_primary():
+            with read_from_primary():
+                self.assertEqual(self.router.db_for_read(Ticket), DEFAULT_DB_ALIAS)
+            self.assertEqual(self.router.db_for_read(Ticket), DEFAULT_DB_ALIAS)
+        self.assertEqual(self.router.db_for_read(Ticket), 'replica')
+
+    def test_no_migrations_on_replica(self):
+        self.assertTrue(self.router.allow_migrate(DEFAULT_DB_ALIAS, 'core'))
+        self.assertFalse(self.router.allow_migrate('replica', 'core'))
+
+    def test_pinned_user_reads_from_primary(self):
+        with sticky_reads('+50688888888'):
+            self.assertEqual(self.router.db_for_read(Ticket), 'replica')
+        pin_to_primary('+50688888888')
+        with sticky_reads('+50688888888'):
+            self.assertEqual(self.router.db_for_read(Ticket), DEFAULT_DB_ALIAS)
+        with sticky_reads('+50677777777'):
+            self.assertEqual(self.router.db_for_read(Ticket), 'replica')
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], TICKET_SHARDS={})
+class WebhookRoutingTests(TransactionTestCase):
+    """ Tests which database serves the webhook's reads, using the replica of the development
+    settings (a mirror of the primary). Not a TestCase: inside its transaction every read stays on
+    the primary.
+    """
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        cache.clear()
+        self.contest = Contest.objects.create(
+            name='Lotto', draw_date=timezone.now() + datetime.timedelta(days=3),
+            prize_pool=1000000, price_per_ticket=1000, regex=r'^\d{4}$')
+
+    def ticket_reads(self, action: str, phone_number: str = '+50688888888', **params) -> list:
+        """ Sends a webhook turn. Returns the aliases that read tickets during it. """
+        with contextlib.ExitStack() as stack:
+            queries = {alias: stack.enter_context(CaptureQueriesContext(connections[alias]))
+                       for alias in self.databases}
+            post_webhook(self.client, dialogflow_payload(action, phone_number, **params))
+        return sorted(alias for alias, captured in queries.items() for query in captured
+                      if query['sql'].startswith('SELECT') and '"core_ticket"' in query['sql'])
+
+    def test_buyer_reads_own_ticket_from_primary(self):
+        self.assertEqual(self.ticket_reads(webhook.LIST_TICKETS), ['replica'])
+        self.ticket_reads(webhook.INITIATE_PURCHASE, contest=self.contest.id, ticket_number='1234')
+        # the availability check before charging is made on the primary
+        self.assertEqual(self.ticket_reads(webhook.CONFIRM_PURCHASE, contest=self.contest.id,
+                                           ticket_number='1234'), [DEFAULT_DB_ALIAS])
+        # the buyer is pinned, and sees the new ticket even if the replica is lagging
+        self.assertEqual(self.ticket_reads(webhook.LIST_TICKETS), [DEFAULT_DB_ALIAS])
+        self.assertEqual(self.ticket_reads(webhook.LIST_TICKETS, '+50677777777'), ['replica'])
@@ -0,0 +1,281 @@
+""" Tests for sharding.py, ShardRouter and the move_contest command. Uses the shard1 and shard2
+databases of the development settings.
+"""
+
+import datetime
+import io
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import DEFAULT_DB_ALIAS
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from core import outbox, purchases, sharding
+from core.models import Contest, OutboxEvent, Ticket
+from core.routers import ShardRouter
+from core.tests.utils import dialogflow_payload, post_webhook
+from core.management.commands import move_contest
+from core.views.dialogflow import webhook
+
+
+TICKET_SHARDS = {
+    'default': 'default',
+    'shard1': 'reservations-shard1',
+    'shard2': 'reservations-shard2',
+}
+PHONE_NUMBER = '+50688888888'
+
+
+def create_contest(name: str, shard: str = '') -> Contest:
+    """ Creates an active contest, placed on the shard if one is given """
+    return Contest.objects.create(name=name, draw_date=timezone.now() + datetime.timedelta(days=3),
+                                  prize_pool=1000000, price_per_ticket=1000, regex=r'^\d{4}$',
+                                  example_number='1234', shard=shard)
+
+
+@override_settings(TICKET_SHARDS=TICKET_SHARDS)
+class ShardingTests(TestCase):
+    """ Tests that tickets, reservations and their events are kept on the contest's shard """
+    databases = {'default', 'shard1', 'shard2'}
+
+    def setUp(self):
+        for alias in TICKET_SHARDS.values():
+            caches[alias].clear()
+
+    def test_new_contests_are_spread_across_shards(self):
+        shards = {create_contest(f'Contest {i}').shard for i in range(3)}
+        self.assertEqual(shards, set(TICKET_SHARDS))
+        # the placement is saved, it doesn't change when more shards are added
+        contest = create_contest('Lotto')
+        with override_settings(TICKET_SHARDS={**TICKET_SHARDS, 'shard3': 'default'}):
+            contest.save()
+            self.assertEqual(Contest.objects.get(id=contest.id).shard, contest.shard)
+
+    @override_settings(TICKET_SHARDS={})
+    def test_no_shards(self):
+        contest = create_contest('Lotto')
+        self.assertEqual(contest.shard, '')
+        self.assertEqual(sharding.shard_for(contest), DEFAULT_DB_ALIAS)
+        self.assertEqual(sharding.get_shards(), [DEFAULT_DB_ALIAS])
+
+    def test_purchase(self):
+        contest = create_contest('Lotto', shard='shard1')
+        for action in (webhook.INITIATE_PURCHASE, webhook.CONFIRM_PURCHASE):
+            post_webhook(self.client, dialogflow_payload(action, contest=contest.id,
+                                                         ticket_number='1234'))
+        self.assertTrue(Ticket.objects.using('shard1').filter(contest=contest, number='1234',
+                                                              phone_number=PHONE_NUMBER).exists())
+        self.assertFalse(Ticket.objects.using(DEFAULT_DB_ALIAS).exists())
+        # the events were committed with the ticket
+        self.assertEqual(
+            list(OutboxEvent.objects.using('shard1').values_list('event_type', flat=True)),
+            [outbox.TICKET_RESERVED, outbox.PAYMENT_SUCCEEDED, outbox.TICKET_PURCHASED])
+        self.assertFalse(OutboxEvent.objects.using(DEFAULT_DB_ALIAS).exists())
+
+    def test_number_is_available(self):
+        contest = create_contest('Lotto', shard='shard2')
+        Ticket.objects.using('shard2').create(contest=contest, number='1234',
+                                              phone_number=PHONE_NUMBER)
+        self.assertFalse(contest.number_is_available('1234'))
+        self.assertTrue(contest.number_is_available('4321'))
+        self.assertEqual(contest.num_tickets_sold(), 1)
+
+    def test_reservations_are_kept_on_the_shard(self):
+        contest = create_contest('Lotto', shard='shard1')
+        purchases.reserve_ticket(contest, '1234', PHONE_NUMBER)
+        key = purchases.get_cache_key('1234', contest)
+        self.assertEqual(caches['reservations-shard1'].get(key), PHONE_NUMBER)
+        self.assertIsNone(caches['default'].get(key))
+        with self.assertRaises(purchases.TicketReserved):
+            purchases.reserve_ticket(contest, '1234', '+50677777777')
+
+    def test_user_tickets_fan_out(self):
+        contests = [create_contest('Lotto', shard=shard) for shard in TICKET_SHARDS]
+        for contest in contests:
+            contest.tickets_sold.create(number='1234', phone_number=PHONE_NUMBER)
+            contest.tickets_sold.create(number='4321', phone_number='+50677777777')
+        past_contest = create_contest('Past', shard='shard1')
+        Contest.objects.filter(id=past_contest.id).update(draw_date=timezone.now())
+        past_contest.tickets_sold.create(number='1234', phone_number=PHONE_NUMBER)
+
+        tickets = purchases.get_user_tickets(PHONE_NUMBER)
+        self.assertCountEqual([t.contest for t in tickets], contests)
+        self.assertCountEqual([t.contest.shard for t in tickets], TICKET_SHARDS)
+
+    def test_deleting_a_contest_deletes_its_tickets(self):
+        contest = create_contest('Lotto', shard='shard2')
+        contest.tickets_sold.create(number='1234', phone_number=PHONE_NUMBER)
+        contest.delete()
+        self.assertFalse(Ticket.objects.using('shard2').exists())
+
+    def test_relay_from_every_shard(self):
+        outbox.record_event(outbox.TICKET_PURCHASED, ticket_number='1234')
+        outbox.record_event(outbox.TICKET_PURCHASED, using='shard1', ticket_number='4321')
+        sink = outbox.QueueSink(name=self.id())
+        self.assertEqual(outbox.relay('analytics', sink, using=DEFAULT_DB_ALIAS), 1)
+        self.assertEqual(outbox.relay('analytics', sink, using='shard1'), 1)
+        self.assertEqual(outbox.relay('analytics', sink, using='shard1'), 0)
+        events = [sink.queue.get_nowait() for _ in range(2)]
+        self.assertEqual([e['shard'] for e in events], [DEFAULT_DB_ALIAS, 'shard1'])
+
+
+@override_settings(TICKET_SHARDS=TICKET_SHARDS)
+class ShardRouterTests(SimpleTestCase):
+    """ Tests for ShardRouter """
+
+    def setUp(self):
+        self.router = ShardRouter()
+
+    def test_tickets_follow_their_contest(self):
+        contest = Contest(id=1, shard='shard2')
+        self.assertEqual(self.router.db_for_read(Ticket, instance=contest), 'shard2')
+        ticket = Ticket(contest=contest)
+        self.assertEqual(self.router.db_for_write(Ticket, instance=ticket), 'shard2')
+
+    def test_primary_is_left_to_next_router(self):
+        self.assertIsNone(self.router.db_for_read(Ticket, instance=Contest(id=1)))
+        self.assertIsNone(self.router.db_for_read(Ticket))
+        self.assertIsNone(self.router.db_for_read(Contest, instance=Contest(id=1, shard='shard1')))
+
+    def test_reservation_tables(self):
+        for alias, shard in (('reservations-shard1', 'shard1'), ('default', None)):
+            model = caches[alias].cache_model_class
+            self.assertEqual(self.router.db_for_write(model), shard)
+
+    def test_migrations(self):
+        self.assertTrue(self.router.allow_migrate('shard1', 'core', 'ticket'))
+        self.assertTrue(self.router.allow_migrate('shard1', 'core', 'outboxevent'))
+        self.assertFalse(self.router.allow_migrate('shard1', 'core', 'user'))
+        self.assertFalse(self.router.allow_migrate('shard1', 'auth', 'group'))
+        self.assertIsNone(self.router.allow_migrate(DEFAULT_DB_ALIAS, 'core', 'ticket'))
+        model = caches['reservations-shard1'].cache_model_class
+        self.assertTrue(self.router.allow_migrate('shard1', 'django_cache', model=model))
+        self.assertFalse(self.router.allow_migrate('shard2', 'django_cache', model=model))
+
+
+class SlowPurchaseMoveCommand(move_contest.Command):
+    """ A move during which slow purchases write to the old shard after the grace period, one
+    before and one during the first copy that follows it
+    """
+    blocked_during_purchase = None
+
+    def copy_tickets(self, contest, source, target, after_id, batch_size):
+        if not after_id or self.blocked_during_purchase is not None:
+            return super().copy_tickets(contest, source, target, after_id, batch_size)
+        self.blocked_during_purchase = Contest.objects.get(id=contest.id).moving
+        Ticket.objects.using(source).create(contest=contest, number='9998',
+                                            phone_number=PHONE_NUMBER)
+        result = super().copy_tickets(contest, source, target, after_id, batch_size)
+        Ticket.objects.using(source).create(contest=contest, number='9999',
+                                            phone_number=PHONE_NUMBER)
+        return result
+
+
+class PurchaseDuringMoveCommand(move_contest.Command):
+    """ A move during which a user tries to buy a ticket after purchases were blocked """
+    purchase_error = None
+
+    def copy_tickets(self, contest, source, target, after_id, batch_size):
+        if after_id:  # the copy made after the grace period
+            try:
+                purchases.buy_ticket(contest.id, '2222', PHONE_NUMBER)
+            except purchases.PurchaseError as e:
+                self.purchase_error = e
+        return super().copy_tickets(contest, source, target, after_id, batch_size)
+
+
+@override_settings(TICKET_SHARDS=TICKET_SHARDS)
+class MoveContestTests(TestCase):
+    """ Tests for the move_contest command """
+    databases = {'default', 'shard1', 'shard2'}
+
+    def move(self, *args, command='move_contest'):
+        call_command(command, *args, grace=0, batch_size=2, stdout=io.StringIO())
+
+    def test_move(self):
+        contest = create_contest('Lotto', shard='shard1')
+        for number in ('1111', '2222', '3333'):
+            contest.tickets_sold.create(number=number, phone_number=PHONE_NUMBER)
+        Ticket.objects.using('shard1').update(purchase_date=datetime.date(2020, 5, 1))
+        other_contest = create_contest('Chances', shard='shard1')
+        other_contest.tickets_sold.create(number='1111', phone_number=PHONE_NUMBER)
+
+        self.move(contest.id, 'shard2')
+        contest.refresh_from_db()
+        self.assertEqual(contest.shard, 'shard2')
+        self.assertCountEqual(contest.tickets_sold.values_list('number', flat=True),
+                              ['1111', '2222', '3333'])
+        self.assertEqual(set(contest.tickets_sold.values_list('purchase_date', flat=True)),
+                         {datetime.date(2020, 5, 1)})
+        self.assertEqual(list(Ticket.objects.using('shard1').all()),
+                         list(other_contest.tickets_sold.all()))
+        self.assertFalse(contest.number_is_available('2222'))
+
+    def test_move_to_primary(self):
+        contest = create_contest('Lotto', shard='shard1')
+        contest.tickets_sold.create(number='1111', phone_number=PHONE_NUMBER)
+        self.move(contest.id, DEFAULT_DB_ALIAS)
+        self.assertEqual(Ticket.objects.using(DEFAULT_DB_ALIAS).get().number, '1111')
+        self.assertFalse(Ticket.objects.using('shard1').exists())
+
+    def test_invalid_moves(self):
+        contest = create_contest('Lotto', shard='shard1')
+        with self.assertRaisesMessage(CommandError, 'Unknown shard'):
+            self.move(contest.id, 'shard9')
+        with self.assertRaisesMessage(CommandError, 'already on shard1'):
+            self.move(contest.id, 'shard1')
+        Ticket.objects.using('shard2').create(contest=contest, number='1111',
+                                              phone_number=PHONE_NUMBER)
+        with self.assertRaisesMessage(CommandError, 'already has tickets'):
+            self.move(contest.id, 'shard2')
+
+    def test_purchase_after_grace_period(self):
+        contest = create_contest('Lotto', shard='shard1')
+        contest.tickets_sold.create(number='1111', phone_number=PHONE_NUMBER)
+        command = SlowPurchaseMoveCommand()
+        self.move(contest.id, 'shard2', command=command)
+        # the contest stayed blocked until the late tickets were copied too
+        self.assertTrue(command.blocked_during_purchase)
+        self.assertCountEqual(Ticket.objects.using('shard2').values_list('number', flat=True),
+                              ['1111', '9998', '9999'])
+        self.assertFalse(Ticket.objects.using('shard1').exists())
+        contest.refresh_from_db()
+        self.assertEqual((contest.shard, contest.moving), ('shard2', False))
+
+    def test_purchases_are_blocked(self):
+        contest = create_contest('Lotto', shard='shard1')
+        contest.tickets_sold.create(number='1111', phone_number=PHONE_NUMBER)
+        command = PurchaseDuringMoveCommand()
+        self.move(contest.id, 'shard2', command=command)
+        self.assertIsInstance(command.purchase_error, purchases.ContestMoving)
+        self.assertFalse(any(Ticket.objects.using(shard).filter(number='2222').exists()
+                             for shard in TICKET_SHARDS))
+        # purchases work again once the contest is on its new shard
+        purchases.buy_ticket(contest.id, '2222', PHONE_NUMBER)
+        self.assertEqual(Ticket.objects.using('shard2').filter(contest=contest).count(), 2)
+        self.assertFalse(Contest.objects.get(id=contest.id).moving)
+
+
+@override_settings(TICKET_SHARDS=TICKET_SHARDS)
+class TicketAdminTests(TestCase):
+    """ Tests that the ticket admin reads from the shard of the selected contest """
+    databases = {'default', 'shard1', 'shard2'}
+
+    def setUp(self):
+        user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+
+    def test_changelist(self):
+        contest = create_contest('Lotto', shard='shard2')
+        ticket = contest.tickets_sold.create(number='1234', phone_number=PHONE_NUMBER)
+        url = reverse('admin:core_ticket_changelist')
+        self.assertContains(self.client.get(url), 'Pick a contest')
+        response = self.client.get(url, {'contest__id__exact': contest.id})
+        self.assertEqual(list(response.context['cl'].result_list), [ticket])
+        change_url = reverse('admin:core_ticket_change', args=[ticket.id])
+        response = self.client.get(change_url,
+                                   {'_changelist_filters': f'contest__id__exact={contest.id}'})
+        self.assertContains(response, '1234')
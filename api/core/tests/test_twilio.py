@@ -0,0 +1,140 @@
+""" Tests for views/twilio/webhook.py and conversation.py """
+
+import base64
+import datetime
+import hashlib
+import hmac
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from core.models import Contest, Ticket
+
+
+PHONE_NUMBER = '+50688888888'
+
+
+def twilio_payload(body: str, phone_number: str = PHONE_NUMBER) -> dict:
+    """ Builds the form Twilio posts for an incoming WhatsApp message """
+    return {
+        'MessageSid': 'SM0123456789abcdef0123456789abcdef',
+        'AccountSid': 'AC0123456789abcdef0123456789abcdef',
+        'From': f'whatsapp:{phone_number}',
+        'To': 'whatsapp:+14155238886',
+        'Body': body,
+        'NumMedia': '0',
+    }
+
+
+@override_settings(TICKET_SHARDS={})  # SHARD_TICKETS may be set, see test_sharding for shards
+class TwilioChannelTests(TestCase):
+    """ Drives whole conversations through the Twilio webhook """
+
+    @classmethod
+    def setUpTestData(cls):
+        draw_date = timezone.now() + datetime.timedelta(days=3)
+        cls.contest = Contest.objects.create(name='Lotto', draw_date=draw_date, prize_pool=1000000,
+                                             price_per_ticket=1000, regex=r'^\d{4}$',
+                                             example_number='1234')
+        cls.other_contest = Contest.objects.create(name='Chances', draw_date=draw_date,
+                                                   prize_pool=500000, price_per_ticket=500,
+                                                   regex=r'^\d{2}$', example_number='12')
+
+    def setUp(self):
+        cache.clear()
+
+    def send(self, body: str, phone_number: str = PHONE_NUMBER) -> str:
+        """ Sends a message to the webhook. Returns the TwiML reply. """
+        response = self.client.post(reverse('twilio-webhook'), twilio_payload(body, phone_number))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/xml')
+        return response.content.decode()
+
+    def test_purchase(self):
+        self.assertIn('comprar', self.send('Hola'))
+        reply = self.send('Quiero comprar')
+        self.assertIn('1. Lotto', reply)
+        self.assertIn('2. Chances', reply)
+        self.assertIn(self.contest.example_number, self.send('1'))
+        self.assertIn('¿Deseas confirmar', self.send('4321'))
+        self.assertIn('Listo!', self.send('Sí, confirmo'))
+        self.assertTrue(Ticket.objects.filter(contest=self.contest, number='4321',
+                                              phone_number=PHONE_NUMBER).exists())
+        self.assertIn('Serie 4321 para Lotto', self.send('mis números'))
+
+    def test_choose_contest_by_name(self):
+        self.send('comprar')
+        self.assertIn(self.other_contest.example_number, self.send('chances'))
+
+    def test_unavailable_number(self):
+        Ticket.objects.create(contest=self.contest, number='4321', phone_number='+50677777777')
+        self.send('comprar')
+        self.send('1')
+        self.assertIn('ya no está disponible', self.send('4321'))
+        self.assertIn('¿Deseas confirmar', self.send('4322'))
+
+    def test_invalid_number(self):
+        self.send('comprar')
+        self.send('1')
+        self.assertIn('formato', self.send('12'))
+
+    def test_number_reserved_by_another_user(self):
+        for message in ('comprar', '1', '4321'):
+            self.send(message, phone_number='+50677777777')
+        self.send('comprar')
+        self.send('1')
+        self.assertIn('reservado', self.send('4321'))
+
+    def test_cancel(self):
+        for message in ('comprar', '1', '4321'):
+            self.send(message)
+        self.assertIn('cancelamos', self.send('no'))
+        self.assertFalse(Ticket.objects.exists())
+        self.assertIn('comprar', self.send('si'))  # back to the start
+
+    def test_unrecognized_answers(self):
+        self.send('comprar')
+        self.assertIn('No entendí', self.send('el de mañana'))
+        self.send('1')
+        self.send('4321')
+        self.assertIn('Respondé "si"', self.send('tal vez'))
+
+    def test_ineligible_phone_number(self):
+        response = self.client.post(reverse('twilio-webhook'),
+                                    {**twilio_payload('comprar'), 'From': 'whatsapp:123'})
+        self.assertIn('no califica', response.content.decode())
+
+
+@override_settings(TWILIO_VALIDATE_SIGNATURE=True, TWILIO_AUTH_TOKEN='secret', TICKET_SHARDS={})
+class TwilioSignatureTests(TestCase):
+    """ Tests for the X-Twilio-Signature check """
+
+    def sign(self, url: str, params: dict, token: str = 'secret') -> str:
+        """ Signs a request the way Twilio does """
+        data = url + ''.join(key + value for key, value in sorted(params.items()))
+        digest = hmac.new(token.encode(), data.encode(), hashlib.sha1).digest()
+        return base64.b64encode(digest).decode()
+
+    def test_valid_signature(self):
+        payload = twilio_payload('hola')
+        signature = self.sign('http://testserver' + reverse('twilio-webhook'), payload)
+        response = self.client.post(reverse('twilio-webhook'), payload,
+                                    HTTP_X_TWILIO_SIGNATURE=signature)
+        self.assertEqual(response.status_code, 200)
+
+    def test_invalid_signature(self):
+        payload = twilio_payload('hola')
+        signature = self.sign('http://testserver' + reverse('twilio-webhook'), payload)
+        response = self.client.post(reverse('twilio-webhook'), {**payload, 'Body': 'comprar'},
+                                    HTTP_X_TWILIO_SIGNATURE=signature)
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(TWILIO_AUTH_TOKEN='')
+    def test_missing_auth_token(self):
+        payload = twilio_payload('hola')
+        signature = self.sign('http://testserver' + reverse('twilio-webhook'), payload, token='')
+        response = self.client.post(reverse('twilio-webhook'), payload,
+                                    HTTP_X_TWILIO_SIGNATURE=signature)
+        self.assertEqual(response.status_code, 403)
@@ -0,0 +1,34 @@
+""" Tests for warmup.py """
+
+import datetime
+
+from django.test import TransactionTestCase, override_settings
+from django.utils import timezone
+
+from core.models import Contest
+from core.warmup import get_warm_aliases, warm_up
+
+
+@override_settings(TICKET_SHARDS={})  # SHARD_TICKETS may be set, see test_sharding for shards
+class WarmUpTests(TransactionTestCase):
+    """ Tests for warm_up. Not a TestCase: the replica connection would block on the test
+    transaction held by the primary.
+    """
+    databases = {'default', 'replica'}
+
+    def test_loads_active_contests(self):
+        Contest.objects.create(name='Lotto', draw_date=timezone.now() + datetime.timedelta(days=3),
+                               prize_pool=1000000, price_per_ticket=1000, regex=r'^\d{2}-\d{3}$')
+        with self.assertLogs('testlogger', 'INFO') as logs:
+            elapsed = warm_up()
+        self.assertGreater(elapsed, 0)
+        self.assertIn('(1 active contests)', logs.output[0])
+
+    @override_settings(DATABASE_REPLICAS=['replica'], CACHE_DATABASE='default')
+    def test_unused_databases_are_left_closed(self):
+        self.assertEqual(get_warm_aliases(), ['default', 'replica'])  # not shard1 nor shard2
+
+    @override_settings(DATABASE_REPLICAS=['replica'], CACHE_DATABASE='cache',
+                       TICKET_SHARDS={'shard1': 'reservations-shard1', 'default': 'default'})
+    def test_warm_aliases(self):
+        self.assertEqual(get_warm_aliases(), ['default', 'replica', 'shard1', 'cache'])
@@ -0,0 +1,200 @@
+""" Tests for views/dialogflow/webhook.py """
+
+import datetime
+import sys
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from core.models import Contest, Ticket
+from core.tests.utils import Budget, dialogflow_payload, measure, post_webhook
+from core.views.dialogflow import webhook
+
+
+PHONE_NUMBER = '+50688888888'
+NEW_PHONE_NUMBER = '+50677777777'
+
+NUM_ACTIVE_CONTESTS = 10
+NUM_PAST_CONTESTS = 10
+TICKETS_PER_CONTEST = 200
+USER_TICKETS_PER_CONTEST = 3
+
+# Per-turn budgets for each webhook action. Keep these tight: a failure here usually means a
+# handler started doing a query per row (N+1) or repeating a lookup. Every turn pays one cache get
+# to check replica stickiness, each DatabaseCache set costs ~4 queries and each outbox event 1.
+BUDGETS = {
+    'list_tickets': Budget(queries=2, cache_ops=1, seconds=0.5),
+    'list_tickets (no tickets)': Budget(queries=2, cache_ops=1, seconds=0.5),
+    'purchase_ticket (pick contest)': Budget(queries=2, cache_ops=1, seconds=0.5),
+    'purchase_ticket (pick number)': Budget(queries=2, cache_ops=1, seconds=0.5),
+    'purchase_ticket': Budget(queries=10, cache_ops=3, seconds=0.5),
+    'purchase_ticket (unavailable)': Budget(queries=3, cache_ops=1, seconds=0.5),
+    'ticket_unavailable.retry': Budget(queries=10, cache_ops=3, seconds=0.5),
+    'confirm_purchase.yes': Budget(queries=19, cache_ops=4, seconds=0.5),
+}
+
+
+@override_settings(TICKET_SHARDS={})  # SHARD_TICKETS may be set, see test_sharding for shards
+class WebhookBudgetTests(TestCase):
+    """ Drives every webhook action over a realistically sized database and checks the number of
+    SQL queries, cache operations and wall time of each turn against BUDGETS. A summary of every
+    measurement is written to stderr when the tests finish.
+    """
+    report = {}
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        contests = [
+            Contest(name=f'Sorteo {i}', draw_date=now + datetime.timedelta(days=i),
+                    prize_pool=1000000, price_per_ticket=1000, regex=r'^\d{4}$',
+                    example_number='1234')
+            for i in range(-NUM_PAST_CONTESTS + 1, NUM_ACTIVE_CONTESTS + 1)
+        ]
+        Contest.objects.bulk_create(contests)
+        contests = list(Contest.objects.all())
+        tickets = []
+        for contest in contests:
+            for i in range(TICKETS_PER_CONTEST):
+                phone_number = PHONE_NUMBER if i < USER_TICKETS_PER_CONTEST else f'+5067{i:07}'
+                tickets.append(Ticket(contest=contest, number=f'{i:04}', phone_number=phone_number))
+        Ticket.objects.bulk_create(tickets)
+        cls.contest = Contest.objects.get_active_contests().first()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        lines = ['', 'Webhook budgets (used / allowed):']
+        for case, (usage, budget) in sorted(cls.report.items()):
+            line = (f'    {case:32} queries {usage.queries:3}/{budget.queries:<3} '
+                    f'cache ops {usage.cache_ops:2}/{budget.cache_ops:<2} '
+                    f'time {usage.seconds * 1000:6.1f}/{budget.seconds * 1000:.0f} ms')
+            if overruns := usage.overruns(budget):
+                line += '  OVER BUDGET: ' + ', '.join(
+                    f'{metric} +{used - allowed:g}' for metric, used, allowed in overruns)
+            lines.append(line)
+        sys.stderr.write('\n'.join(lines) + '\n')
+
+    def setUp(self):
+        cache.clear()
+
+    def assertWithinBudget(self, case: str, payload: dict):
+        """ Posts the payload to the webhook and checks the turn against BUDGETS[case]. Returns the
+        response.
+        """
+        budget = BUDGETS[case]
+        with measure() as usage:
+            response = post_webhook(self.client, payload)
+        self.report[case] = (usage, budget)
+        self.assertEqual(response.status_code, 200)
+        if overruns := usage.overruns(budget):
+            self.fail(f'"{case}" exceeded its budget: ' + ', '.join(
+                f'{metric} {used:g} > {allowed:g} (+{used - allowed:g})'
+                for metric, used, allowed in overruns))
+        return response
+
+    def test_list_tickets(self):
+        response = self.assertWithinBudget(
+            'list_tickets', dialogflow_payload(webhook.LIST_TICKETS, PHONE_NUMBER))
+        text = response.data['fulfillmentText']
+        self.assertEqual(text.count('🎟'), NUM_ACTIVE_CONTESTS * USER_TICKETS_PER_CONTEST)
+
+    def test_list_tickets_no_tickets(self):
+        response = self.assertWithinBudget(
+            'list_tickets (no tickets)', dialogflow_payload(webhook.LIST_TICKETS, NEW_PHONE_NUMBER))
+        self.assertNotIn('🎟', response.data['fulfillmentText'])
+
+    def test_initiate_purchase_pick_contest(self):
+        response = self.assertWithinBudget(
+            'purchase_ticket (pick contest)',
+            dialogflow_payload(webhook.INITIATE_PURCHASE, contest='', ticket_number=''))
+        self.assertEqual(response.data['fulfillmentText'].count('•'), NUM_ACTIVE_CONTESTS)
+
+    def test_initiate_purchase_pick_number(self):
+        response = self.assertWithinBudget(
+            'purchase_ticket (pick number)',
+            dialogflow_payload(webhook.INITIATE_PURCHASE, contest=self.contest.id,
+                               ticket_number=''))
+        self.assertIn(self.contest.example_number, response.data['fulfillmentText'])
+
+    def test_initiate_purchase(self):
+        response = self.assertWithinBudget(
+            'purchase_ticket',
+            dialogflow_payload(webhook.INITIATE_PURCHASE, contest=self.contest.id,
+                               ticket_number='9999'))
+        self.assertEqual(response.data['followupEventInput']['name'], 'confirm_purchase')
+
+    def test_initiate_purchase_unavailable(self):
+        response = self.assertWithinBudget(
+            'purchase_ticket (unavailable)',
+            dialogflow_payload(webhook.INITIATE_PURCHASE, contest=self.contest.id,
+                               ticket_number='0100'))
+        self.assertEqual(response.data['followupEventInput']['name'], 'ticket_unavailable')
+
+    def test_ticket_unavailable_retry(self):
+        response = self.assertWithinBudget(
+            'ticket_unavailable.retry',
+            dialogflow_payload(webhook.TICKET_UNAVAILABLE_RETRY, contest=self.contest.id,
+                               ticket_number='9999'))
+        self.assertEqual(response.data['followupEventInput']['name'], 'confirm_purchase')
+
+    def test_confirm_purchase(self):
+        self.assertWithinBudget(
+            'confirm_purchase.yes',
+            dialogflow_payload(webhook.CONFIRM_PURCHASE, NEW_PHONE_NUMBER, contest=self.contest.id,
+                               ticket_number='9999'))
+        self.assertTrue(Ticket.objects.filter(contest=self.contest, number='9999',
+                                              phone_number=NEW_PHONE_NUMBER).exists())
+
+
+@override_settings(WEBHOOK_DEADLINE=0.3, WEBHOOK_DEADLINE_RESERVE=0.1, WEBHOOK_MAX_RESUMES=2,
+                   TICKET_SHARDS={})
+class WebhookDeadlineTests(TestCase):
+    """ Checks that turns slowed down by injected latency are resumed instead of timing out """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.contest = Contest.objects.create(
+            name='Lotto', draw_date=timezone.now() + datetime.timedelta(days=3),
+            prize_pool=1000000, price_per_ticket=1000, regex=r'^\d{4}$')
+
+    def setUp(self):
+        cache.clear()
+
+    def confirm_purchase(self, **params):
+        """ Posts a confirm_purchase turn for ticket 1234 """
+        return post_webhook(self.client, dialogflow_payload(
+            webhook.CONFIRM_PURCHASE, contest=self.contest.id, ticket_number='1234', **params))
+
+    def test_slow_turn_is_resumed(self):
+        with override_settings(FAULT_INJECTION={'db': 0.05}):
+            response = self.confirm_purchase()
+        event = response.data['followupEventInput']
+        self.assertEqual(event['name'], webhook.RESUME_EVENT)
+        self.assertEqual(event['parameters']['action'], webhook.CONFIRM_PURCHASE)
+        self.assertEqual(event['parameters']['attempt'], 1)
+        self.assertFalse(Ticket.objects.exists())  # gave up before charging the user
+
+        # the next turn finishes the purchase
+        payload = dialogflow_payload(webhook.RESUME, **event['parameters'])
+        response = post_webhook(self.client, payload)
+        self.assertIn('Listo!', response.data['fulfillmentText'])
+        self.assertTrue(Ticket.objects.filter(contest=self.contest, number='1234').exists())
+
+    def test_slow_cache_is_resumed(self):
+        with override_settings(FAULT_INJECTION={'cache': 0.1}):
+            response = self.confirm_purchase()
+        self.assertEqual(response.data['followupEventInput']['name'], webhook.RESUME_EVENT)
+        self.assertFalse(Ticket.objects.exists())
+
+    def test_gives_up_after_max_resumes(self):
+        with override_settings(FAULT_INJECTION={'db': 0.05}):
+            response = post_webhook(self.client, dialogflow_payload(
+                webhook.RESUME, action=webhook.CONFIRM_PURCHASE, attempt=2,
+                contest=self.contest.id, ticket_number='1234'))
+        self.assertIn('problemas técnicos', response.data['fulfillmentText'])
+
+    def test_fast_turn_is_not_affected(self):
+        response = self.confirm_purchase()
+        self.assertIn('Listo!', response.data['fulfillmentText'])
@@ -0,0 +1,117 @@
+""" Shared helpers for the test suite """
+
+import contextlib
+import functools
+import time
+from typing import NamedTuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import request_started
+from django.db import connections, reset_queries
+from django.urls import reverse
+
+
+CACHE_METHODS = ('get', 'set', 'add', 'delete', 'get_many', 'set_many', 'delete_many', 'has_key',
+                 'incr', 'decr', 'touch', 'clear')
+
+
+def dialogflow_payload(action: str, phone_number: str = '+50688888888', /, **params) -> dict:
+    """ Builds the body of a Dialogflow fulfillment request as sent through the Twilio integration
+    """
+    return {
+        'queryResult': {
+            'action': action,
+            'parameters': params,
+        },
+        'originalDetectIntentRequest': {
+            'payload': {'data': {'From': f'whatsapp:{phone_number}'}},
+        },
+    }
+
+
+def post_webhook(client, payload: dict):
+    """ Posts a Dialogflow payload to the webhook """
+    return client.post(reverse('dialogflow-webhook'), payload, content_type='application/json')
+
+
+class Budget(NamedTuple):
+    """ Upper bounds on the resources a single webhook turn may use """
+    queries: int  # SQL queries on every database, including the ones made by the DatabaseCache
+    cache_ops: int  # calls to the API of every cache (get, set, etc.)
+    seconds: float  # wall time
+
+
+class Usage:
+    """ Resources used inside a measure() block """
+    queries = 0
+    cache_ops = 0
+    seconds = 0.0
+
+    def overruns(self, budget: Budget) -> list:
+        """ Returns a (metric, used, allowed) tuple for each limit in the budget that was exceeded
+        """
+        return [(metric, getattr(self, metric), allowed)
+                for metric, allowed in budget._asdict().items()
+                if getattr(self, metric) > allowed]
+
+
+@contextlib.contextmanager
+def measure():
+    """ Measures the SQL queries, cache operations and wall time spent inside the block """
+    usage = Usage()
+    with _count_queries(usage), _count_cache_ops(usage):
+        start = time.perf_counter()
+        yield usage
+        usage.seconds = time.perf_counter() - start
+
+
+@contextlib.contextmanager
+def _count_queries(usage: Usage):
+    """ Counts the queries on every database: replicas, shards and the cache's too. Unlike
+    CaptureQueriesContext it doesn't open the connections, tests may not be allowed to use them all.
+    """
+    initial = {}
+    for conn in connections.all():
+        initial[conn] = (conn.force_debug_cursor, len(conn.queries_log))
+        conn.force_debug_cursor = True
+    request_started.disconnect(reset_queries)  # the test client would clear the logs
+    try:
+        yield
+    finally:
+        request_started.connect(reset_queries)
+        for conn, (force_debug_cursor, queries) in initial.items():
+            conn.force_debug_cursor = force_debug_cursor
+            usage.queries += len(conn.queries_log) - queries
+
+
+@contextlib.contextmanager
+def _count_cache_ops(usage: Usage):
+    """ Counts calls to every cache, including the reservation caches of the shards. Calls a
+    backend makes to itself (eg DatabaseCache.get calling get_many) are not counted.
+    """
+    backends = [caches[alias] for alias in settings.CACHES]
+    depth = 0
+
+    def counted(method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            nonlocal depth
+            if depth == 0:
+                usage.cache_ops += 1
+            depth += 1
+            try:
+                return method(*args, **kwargs)
+            finally:
+                depth -= 1
+        return wrapper
+
+    for backend in backends:
+        for name in CACHE_METHODS:
+            setattr(backend, name, counted(getattr(backend, name)))
+    try:
+        yield
+    finally:
+        for backend in backends:
+            for name in CACHE_METHODS:
+                delattr(backend, name)
@@ -1,7 +1,9 @@
 from django.urls import path
 
 from core.views.dialogflow.webhook import webhook
+from core.views.twilio.webhook import webhook as twilio_webhook
 
 urlpatterns = [
     path('dialogflow/webhook', webhook, name='dialogflow-webhook'),
+    path('twilio/webhook', twilio_webhook, name='twilio-webhook'),
 ]
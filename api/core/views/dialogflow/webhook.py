@@ -1,23 +1,23 @@
 """ Handles fulfillment and slot-filling webhooks coming from Dialogflow """
 
 import logging
-import re
 
 from django.conf import settings
-from django.core.cache import cache
-from django.db.utils import IntegrityError
 from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 
-from core.models import Ticket, Contest
+from core import deadline, messages, purchases
+from core.models import Contest
+from core.routers import sticky_reads
 
 
 LIST_TICKETS = 'list_tickets'
 INITIATE_PURCHASE = 'purchase_ticket'
 CONFIRM_PURCHASE = 'confirm_purchase.yes'
 TICKET_UNAVAILABLE_RETRY = 'ticket_unavailable.retry'
-PHONE_NUMBER_REGEX = r'\+[0-9]{6,15}'  # determines which phone numbers are eligible to buy lottery
+RESUME = 'resume'  # action of the intent triggered by RESUME_EVENT
+RESUME_EVENT = 'resume'
 
 
 logger = logging.getLogger('testlogger')  # this is the logger defined by django-heroku
@@ -31,42 +31,42 @@ def webhook(request):
     except AttributeError:
         logger.error('AttributeError encountered when trying to extract action from request')
         return Response('Action not found in the request', status=status.HTTP_400_BAD_REQUEST)
+    params = request.data['queryResult'].get('parameters', {})
+    attempt = 0
+    if action == RESUME:  # a turn that ran out of time, see resume_response
+        action, attempt = params.get('action'), int(params.get('attempt', 0))
     phone_number = get_phone_number(request)
-    if action == LIST_TICKETS:
-        return list_tickets(phone_number)
-    if action == INITIATE_PURCHASE:
-        return initiate_purchase(request)
-    if action == CONFIRM_PURCHASE:
-        return confirm_purchase(request)
-    if action == TICKET_UNAVAILABLE_RETRY:
-        return ticket_unavailable_retry(request)
+    try:
+        with deadline.enforce(settings.WEBHOOK_DEADLINE), sticky_reads(phone_number):
+            # sticky_reads: users who just bought a ticket read from the primary
+            if action == LIST_TICKETS:
+                return list_tickets(phone_number)
+            if action == INITIATE_PURCHASE:
+                return initiate_purchase(request)
+            if action == CONFIRM_PURCHASE:
+                return confirm_purchase(request)
+            if action == TICKET_UNAVAILABLE_RETRY:
+                return ticket_unavailable_retry(request)
+    except deadline.DeadlineExceeded as e:
+        logger.warning('Ran out of time handling "%s" (attempt %d): %s', action, attempt, e)
+        return resume_response(action, params, attempt + 1)
     logger.error('Dialogflow action "%s" not recognized', action)
     return Response(f'Action "{action}" not recognized', status=status.HTTP_400_BAD_REQUEST)
 
 
 def list_tickets(phone_number):
     """ List a user's tickets """
-    tickets = Ticket.objects.filter(phone_number=phone_number)
-    if tickets.exists():
-        message = ""
-        for t in tickets:
-            if t.contest.is_active:
-                message += f'    🎟 Serie {t.number} para {t.contest}\n'
-        if message:
-            message.strip()
-            return text_response('Tenes los siguientes numeros:\n' + message)
-    return text_response('Todavía no has comprado tiquetes para los próximos sorteos.')
+    return text_response(messages.tickets_message(purchases.get_user_tickets(phone_number)))
 
 
 def initiate_purchase(request):
     """ Initiates the ticket purchase flow, validating the parameters provided by the user. If any
-    problems are found with the parameters a non-empty error_response will be reutrned to prompt the
-    user for correction. The method also returns a dictionary holding the validated parameters.
+    problems are found with the parameters the user is prompted for a correction. Once they are
+    valid the ticket is reserved and the user is asked to confirm the purchase.
     """
     # validate phone number
     if (phone_number := get_phone_number(request)) is None:
-        return text_response('Lo sentimos pero tu número de celular no califica para hacer compras'
-                             'de lotería.')
+        return text_response(messages.NOT_ELIGIBLE)
 
     params = request.data['queryResult']['parameters']
 
@@ -74,88 +74,35 @@ def initiate_purchase(request):
     contest_id = params['contest']
     if contest_id:
         try:
-            contest = Contest.objects.get_active_contests().get(id=contest_id)
+            contest = purchases.get_active_contest(contest_id)
         except Contest.DoesNotExist:
-            return text_response('Error: El sorteo que querés jugar no está disponible.')
-    else:
-        contests = Contest.objects.get_active_contests()
-        if contests.exists():
-            message = 'En cual sorteo estás interesado? Las opciones son:\n'
-            for c in Contest.objects.get_active_contests():
-                message += f'    • {c}: por un premio de ₡{c.prize_pool}\n'
-            return text_response(message)
-        else:
-            return text_response('Desafortunadamente, no hay sorteos disponibles en este momento.')
-
-    # validate ticket number
-    ticket_number = params['ticket_number']
-    if ticket_number:
-        try:
-            ticket_available = contest.number_is_available(ticket_number)
-        except ValueError:
-            return text_response(f'El número no está en el formato correcto. Escribí el número que'
-                                 f'querés en este formato: {contest.example_number}')
-        if ticket_available:
-            # reserved by another user
-            cache_hit = cache.get(get_cache_key(ticket_number, contest))
-            if cache_hit is not None and cache_hit != phone_number:
-                return text_response('Desafortunadamente, el tiquete que querés está reservado '
-                                     'por otro usuario. Intentá de nuevo en 15 mins. para ver si '
-                                     'se liberó.')
-        else:
-            return event_trigger_response('ticket_unavailable', {'contest': contest_id})
+            return text_response(messages.CONTEST_UNAVAILABLE)
     else:
-        return text_response(f'¿Qué número te gustaría comprar? En este sorteo los números tienen '
-                             f'el siguiente formato {contest.example_number}, y cuestan '
-                             f'₡{contest.price_per_ticket} cada uno')
+        contests = list(Contest.objects.get_active_contests())  # one query for check + listing
+        return text_response(messages.contests_message(contests))
 
-    # All parameters are validated
-    # reserve number on cache
-    cache.set(get_cache_key(ticket_number, contest), phone_number,
-              timeout=settings.RESERVATION_THRESHOLD)
-
-    params = {
-        "phone_number": phone_number,  # may not need it
-        "contest": contest_id,
-        "contest-name": contest.name,
-        "price": contest.price_per_ticket,
-        "ticket_number": ticket_number,
-    }
-    return event_trigger_response('confirm_purchase', params)
+    return reserve_ticket(contest, params['ticket_number'], phone_number)
 
 
 def ticket_unavailable_retry(request):
     """ Responds to a retry if the first number tried by the user was unavailable """
-    # TODO cut out repeated code
     params = request.data['queryResult']['parameters']
-    phone_number = get_phone_number(request)
-    contest_id = params['contest']
-    contest = Contest.objects.get_active_contests().get(id=contest_id)
-    ticket_number = params.get('ticket_number')
-    if ticket_number:
-        try:
-            ticket_available = contest.number_is_available(ticket_number)
-        except ValueError:
-            return text_response(f'El número no está en el formato correcto. Escribí el número que'
-                                 f'querés en este formato: {contest.example_number}')
-        if ticket_available:
-            # reserved by another user
-            cache_hit = cache.get(get_cache_key(ticket_number, contest))
-            if cache_hit is not None and cache_hit != phone_number:
-                return text_response('Desafortunadamente, el tiquete que querés está reservado '
-                                     'por otro usuario. Intentá de nuevo en 15 mins. para ver si '
-                                     'se liberó.')
-        else:
-            return event_trigger_response('ticket_unavailable', {'contest': contest.id})
-    else:
-        return text_response(f'¿Qué número te gustaría comprar? En este sorteo los números tienen '
-                             f'el siguiente formato {contest.example_number}, y cuestan '
-                             f'₡{contest.price_per_ticket} cada uno')
+    contest = purchases.get_active_contest(params['contest'])
+    return reserve_ticket(contest, params.get('ticket_number'), get_phone_number(request))
 
-    # All parameters are validated
-    # reserve number on cache
-    cache.set(get_cache_key(ticket_number, contest), phone_number,
-              timeout=settings.RESERVATION_THRESHOLD)
+
+def reserve_ticket(contest: Contest, ticket_number: str, phone_number: str) -> Response:
+    """ Reserves the ticket and asks the user to confirm the purchase, or prompts them for another
+    number
+    """
+    if not ticket_number:
+        return text_response(messages.pick_number_message(contest))
+    try:
+        purchases.reserve_ticket(contest, ticket_number, phone_number)
+    except purchases.TicketUnavailable:
+        return event_trigger_response('ticket_unavailable', {'contest': contest.id})
+    except purchases.PurchaseError as e:
+        return text_response(str(e))
 
     params = {
         "phone_number": phone_number,  # may not need it
@@ -166,60 +113,34 @@ def ticket_unavailable_retry(request):
     }
     return event_trigger_response('confirm_purchase', params)
 
+
 def confirm_purchase(request):
     """ Confirms purchase of a ticket """
     params = request.data['queryResult']['parameters']
-    contest = Contest.objects.get_active_contests().get(id=params['contest'])
     ticket_number = params['ticket_number']
-    phone_number = get_phone_number(request)
-
-    # redundancy check that ticket is avaiable
     try:
-        ticket_available = contest.number_is_available(ticket_number)
-    except ValueError:
-        return text_response(f'El número no está en el formato correcto. Escribí el número que'
-                             f'querés en este formato: {contest.example_number}')
-    if not ticket_available:
-        return text_response('Desafortunadamente, el tiquete que querés ya no está disponible 😢')
-    # check the cache
-    cache_hit = cache.get(get_cache_key(ticket_number, contest))
-    if  cache_hit is not None and cache_hit != phone_number:
-        return text_response('Desafortunadamente, el tiquete que querés está reservado '
-                             'por otro usuario. Intentá de nuevo en 15 mins. para ver si se '
-                             'liberó.')
-    # set cache again in case the reservation had expired
-    cache.set(get_cache_key(ticket_number, contest), phone_number,
-              timeout=settings.RESERVATION_THRESHOLD)
-
-    # process payment
-    print(f'SIMULATING CALL TO PAYMENT API. CHARGING ₡{contest.price_per_ticket} TO'
-          f'{phone_number}')
-    payment_succeded = True  # simulating success of payment
-    if payment_succeded:
-        try:
-            Ticket.objects.create(contest=contest, number=ticket_number, phone_number=phone_number)
-        except IntegrityError:
-            logger.critical('Failed to create ticket %s (contest %s) for user %s who already paid',
-                             ticket_number, str(contest), phone_number)
-            # TODO add slack notif
-            return text_response('Hubo un error reservando tu numero. Estamos investigandolo y te'\
-                                 ' contactaermos pronto.')
-        message = f'Listo! Tu compra del compra del numero "{ticket_number}" para el sorteo '\
-                  f'{contest}" fue exitosa. Buena suerte! 🍀'
-    else:  # TODO identify failure reason and notify slack if it was a system issue
-        logger.info('Payment failed for phone number %s', phone_number)
-        message = 'Desafortunadamente, hubo un problema procesando el pago. Por favor intenta más'\
-                  'tarde.'
-    return text_response(message)
+        contest = purchases.buy_ticket(params['contest'], ticket_number, get_phone_number(request))
+    except purchases.PurchaseError as e:
+        return text_response(str(e))
+    return text_response(messages.purchase_success_message(contest, ticket_number))
+
+
+def resume_response(action: str, params: dict, attempt: int) -> Response:
+    """ Asks Dialogflow to call the webhook again to finish a turn that ran out of time. The RESUME
+    intent passes its parameters back, so the original action and parameters are sent along.
+    """
+    if attempt > settings.WEBHOOK_MAX_RESUMES:
+        return text_response('Estamos teniendo problemas técnicos 😓. Por favor intentá de nuevo en '
+                             'unos minutos.')
+    return event_trigger_response(RESUME_EVENT, {**params, 'action': action, 'attempt': attempt})
 
 
 # utility functions
 
 def get_phone_number(request):
     """ Extracts and validates the user's phone number from the request """
-    string = request.data['originalDetectIntentRequest']['payload']['data']['From']
-    if match := re.search(PHONE_NUMBER_REGEX, string):
-        return match.group()
+    return purchases.parse_phone_number(
+        request.data['originalDetectIntentRequest']['payload']['data']['From'])
 
 
 def text_response(text: str) -> Response:
@@ -240,8 +161,3 @@ def event_trigger_response(event: str, params: dict) -> Response:
             "parameters": params
         }
     }, status=status.HTTP_200_OK)
-
-
-def get_cache_key(ticket_number: str, contest: Contest) -> str:
-    """ Gives a unique string to identify a ticket in the cache """
-    return f'{contest.id}--{ticket_number}'
@@ -0,0 +1,56 @@
+""" Handles incoming SMS/WhatsApp messages sent straight from Twilio, skipping Dialogflow. Messages
+are answered by the local state machine in core.conversation.
+"""
+
+import base64
+import hashlib
+import hmac
+import logging
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from core import conversation, messages, purchases
+from core.routers import sticky_reads
+
+
+logger = logging.getLogger('testlogger')  # this is the logger defined by django-heroku
+
+
+@csrf_exempt
+@require_POST
+def webhook(request):
+    """ This method handles Twilio's incoming message webhook """
+    if settings.TWILIO_VALIDATE_SIGNATURE and not has_valid_signature(request):
+        logger.error('Rejected Twilio webhook with an invalid signature')
+        return HttpResponseForbidden()
+    if (phone_number := purchases.parse_phone_number(request.POST.get('From', ''))) is None:
+        return twiml_response(messages.NOT_ELIGIBLE)
+    with sticky_reads(phone_number):  # users who just bought a ticket read from the primary
+        reply = conversation.handle_message(phone_number, request.POST.get('Body', ''))
+    return twiml_response(reply)
+
+
+def has_valid_signature(request) -> bool:
+    """ Checks the X-Twilio-Signature header: the base64 HMAC-SHA1 (keyed with the auth token) of
+    the url followed by every POST parameter and its value, sorted by name. Fails when there is no
+    auth token: anyone can sign with an empty key.
+    """
+    if not settings.TWILIO_AUTH_TOKEN:
+        logger.error('TWILIO_AUTH_TOKEN is not set, Twilio webhooks will be rejected')
+        return False
+    data = request.build_absolute_uri() + ''.join(
+        key + value for key, value in sorted(request.POST.items()))
+    digest = hmac.new(settings.TWILIO_AUTH_TOKEN.encode(), data.encode(), hashlib.sha1).digest()
+    expected = base64.b64encode(digest).decode()
+    return hmac.compare_digest(expected, request.headers.get('X-Twilio-Signature', ''))
+
+
+def twiml_response(text: str) -> HttpResponse:
+    """ Wraps a reply in the TwiML Twilio expects """
+    return HttpResponse(f'<?xml version="1.0" encoding="UTF-8"?>'
+                        f'<Response><Message>{escape(text)}</Message></Response>',
+                        content_type='application/xml')
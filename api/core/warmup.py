@@ -0,0 +1,45 @@
+""" Prepares a freshly started web worker so its first webhook turn is as fast as later ones """
+
+import logging
+import re
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.urls import get_resolver
+from rest_framework.settings import api_settings
+
+from core.models import Contest
+
+
+logger = logging.getLogger('testlogger')  # this is the logger defined by django-heroku
+
+
+def warm_up():
+    """ Opens the connections to the databases the app uses (see get_warm_aliases), imports the
+    URLconf (and with it the webhook views), resolves DRF's renderer and parser classes, and loads
+    the active contests compiling their ticket number regexes. Returns the time it took, in seconds.
+    """
+    start = time.perf_counter()
+    for alias in get_warm_aliases():
+        connections[alias].ensure_connection()
+    get_resolver().url_patterns  # pylint: disable=expression-not-assigned
+    api_settings.DEFAULT_RENDERER_CLASSES  # pylint: disable=expression-not-assigned
+    api_settings.DEFAULT_PARSER_CLASSES  # pylint: disable=expression-not-assigned
+    cache.get('warm-up')  # touches the cache table
+    contests = list(Contest.objects.get_active_contests())
+    for contest in contests:
+        re.compile(contest.regex)  # re caches compiled patterns, re.match then skips compiling
+    elapsed = time.perf_counter() - start
+    logger.info('Worker warmed up in %.0f ms (%d active contests)', elapsed * 1000, len(contests))
+    return elapsed
+
+
+def get_warm_aliases() -> list:
+    """ The aliases of the databases a webhook turn may use: the primary, its replicas, the ticket
+    shards and the cache's. Other aliases in DATABASES (eg the benchmarks') are left closed.
+    """
+    aliases = [DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS, *settings.TICKET_SHARDS,
+               settings.CACHE_DATABASE]
+    return list(dict.fromkeys(aliases))
@@ -0,0 +1,17 @@
+""" Gunicorn settings (see the Procfile) """
+
+# Import Django, DRF and the project once in the master so new workers start with them loaded
+# instead of paying for the imports on their first request.
+preload_app = True
+
+
+def post_fork(server, worker):
+    """ Runs in each worker before it starts accepting requests. Database connections are opened
+    here and not in the master, since connections must not be shared across processes.
+    """
+    from core.warmup import warm_up  # pylint: disable=import-outside-toplevel
+    try:
+        warm_up()
+    except Exception:  # pylint: disable=broad-except
+        # a cold worker is better than no worker
+        server.log.exception('Warm-up failed for worker %s', worker.pid)